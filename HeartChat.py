@@ -1,425 +1,649 @@
-import json
-import os
-import tkinter as tk
-from tkinter import ttk, scrolledtext, messagebox, StringVar, BooleanVar, Toplevel
-from pydantic import BaseModel
-import requests
-import threading
-import re
-
-# 定义配置模型
-class Config(BaseModel):
-    api_url: str = "https://api.example.com/v1/chat/completions"
-    api_key: str = "your_api_key_here"
-    model: str = "default_model"
-    user_name: str = "用户"
-    robot_name: str = "AI"
-    analysis_prompt_file: str = "无"  # 分析机器人的提示词文件
-    reply_prompt_file: str = "无"     # 回复机器人的提示词文件
-    context_enabled: bool = False
-
-    def save_to_file(self, file_path="config.json"):
-        with open(file_path, "w", encoding="utf-8") as f:
-            json.dump(self.dict(), f, indent=4)
-
-    @classmethod
-    def load_from_file(cls, file_path="config.json"):
-        if not os.path.exists(file_path):
-            return cls()
-        try:
-            with open(file_path, "r", encoding="utf-8") as f:
-                data = json.load(f)
-            return cls(**data)
-        except json.JSONDecodeError:
-            return cls()
-
-# 定义聊天工具类
-class RobotChatTool:
-    def __init__(self, root):
-        self.root = root
-        self.root.title("Robot Chat Tool")
-        self.config = Config.load_from_file()
-        self.emotion_window = None  # 分析机器人的分析窗口
-        self.expected_window = None  # 回复机器人的回复窗口
-        self.last_robot_reply = None  # 存储机器人的回复内容
-        self.prompt_files = self.get_prompt_files()  # 获取当前目录下的所有 .txt 文件
-        self.create_widgets()
-
-    def get_prompt_files(self):
-        """获取当前目录下所有 .txt 后缀的文件"""
-        prompt_files = [f for f in os.listdir() if f.endswith('.txt')]
-        prompt_files.insert(0, "无")  # 添加“无”选项
-        return prompt_files
-
-    def create_widgets(self):
-        # 配置框
-        config_frame = ttk.LabelFrame(self.root, text="配置", padding=5)
-        config_frame.pack(padx=10, pady=5, fill="x")
-
-        ttk.Label(config_frame, text="API URL:").grid(row=0, column=0, sticky="w")
-        self.api_url_entry = ttk.Entry(config_frame, width=50)
-        self.api_url_entry.grid(row=0, column=1, padx=5, pady=2)
-        self.api_url_entry.insert(0, self.config.api_url)
-
-        ttk.Label(config_frame, text="API Key:").grid(row=1, column=0, sticky="w")
-        self.api_key_entry = ttk.Entry(config_frame, width=50)
-        self.api_key_entry.grid(row=1, column=1, padx=5, pady=2)
-        self.api_key_entry.insert(0, self.config.api_key)
-
-        ttk.Label(config_frame, text="模型:").grid(row=2, column=0, sticky="w")
-        self.model_entry = ttk.Entry(config_frame, width=50)
-        self.model_entry.grid(row=2, column=1, padx=5, pady=2)
-        self.model_entry.insert(0, self.config.model)
-
-        ttk.Label(config_frame, text="用户名:").grid(row=3, column=0, sticky="w")
-        self.user_name_entry = ttk.Entry(config_frame, width=50)
-        self.user_name_entry.grid(row=3, column=1, padx=5, pady=2)
-        self.user_name_entry.insert(0, self.config.user_name)
-
-        ttk.Label(config_frame, text="机器人名字:").grid(row=4, column=0, sticky="w")
-        self.robot_name_entry = ttk.Entry(config_frame, width=50)
-        self.robot_name_entry.grid(row=4, column=1, padx=5, pady=2)
-        self.robot_name_entry.insert(0, self.config.robot_name)
-
-        # 分析机器人的提示词文件选择框
-        ttk.Label(config_frame, text="【分析】提示词文件:").grid(row=5, column=0, sticky="w")
-        self.analysis_prompt_file_var = StringVar()
-        self.analysis_prompt_file_combobox = ttk.Combobox(
-            config_frame,
-            textvariable=self.analysis_prompt_file_var,
-            values=self.prompt_files,
-            state='readonly'
-        )
-        self.analysis_prompt_file_combobox.grid(row=5, column=1, padx=5, pady=2, sticky="w")
-        self.analysis_prompt_file_combobox.set(self.config.analysis_prompt_file)
-
-        # 回复机器人的提示词文件选择框
-        ttk.Label(config_frame, text="【回复】提示词文件:").grid(row=6, column=0, sticky="w")
-        self.reply_prompt_file_var = StringVar()
-        self.reply_prompt_file_combobox = ttk.Combobox(
-            config_frame,
-            textvariable=self.reply_prompt_file_var,
-            values=self.prompt_files,
-            state='readonly'
-        )
-        self.reply_prompt_file_combobox.grid(row=6, column=1, padx=5, pady=2, sticky="w")
-        self.reply_prompt_file_combobox.set(self.config.reply_prompt_file)
-
-        # 上下文复选框
-        self.context_enabled_var = BooleanVar(value=self.config.context_enabled)
-        ttk.Checkbutton(config_frame, text="开启上下文", variable=self.context_enabled_var).grid(row=7, column=0, sticky="w")
-
-        save_config_button = ttk.Button(config_frame, text="保存配置", command=self.save_config)
-        save_config_button.grid(row=8, column=1, pady=5, sticky="e")
-
-        # 聊天框
-        chat_frame = ttk.LabelFrame(self.root, text="聊天", padding=5)
-        chat_frame.pack(padx=10, pady=5, fill="both", expand=True)
-        self.chat_display = scrolledtext.ScrolledText(chat_frame, wrap=tk.WORD, width=60, height=20)
-        self.chat_display.pack(padx=5, pady=5, fill="both", expand=True)
-
-        # 输入框
-        input_frame = ttk.Frame(self.root)
-        input_frame.pack(padx=10, pady=5, fill="x")
-        self.user_input = ttk.Entry(input_frame)
-        self.user_input.pack(side="left", fill="x", expand=True, padx=(0, 5))
-        send_button = ttk.Button(input_frame, text="发送", command=self.send_message)
-        send_button.pack(side="right")
-
-    def save_config(self):
-        self.config.api_url = self.api_url_entry.get()
-        self.config.api_key = self.api_key_entry.get()
-        self.config.model = self.model_entry.get()
-        self.config.user_name = self.user_name_entry.get()
-        self.config.robot_name = self.robot_name_entry.get()
-        self.config.analysis_prompt_file = self.analysis_prompt_file_var.get()
-        self.config.reply_prompt_file = self.reply_prompt_file_var.get()
-        self.config.context_enabled = self.context_enabled_var.get()
-        self.config.save_to_file()
-        messagebox.showinfo("提示", "配置已保存！")
-
-    def send_message(self):
-        user_message = self.user_input.get()
-        if not user_message:
-            return
-        self.chat_display.insert(tk.END, f"{self.config.user_name}: {user_message}\n")
-        self.user_input.delete(0, tk.END)
-
-        # 读取【分析】机器人的提示词文件内容
-        analysis_prompt_file = self.analysis_prompt_file_var.get()
-        if analysis_prompt_file != "无":
-            try:
-                with open(analysis_prompt_file, "r", encoding="utf-8") as f:
-                    analysis_prompt_content = f.read().strip()
-            except FileNotFoundError:
-                analysis_prompt_content = f"{self.config.robot_name}，你是一个情绪分析机器人，请分析用户的情绪。"
-                messagebox.showwarning("警告", f"提示词文件 {analysis_prompt_file} 未找到，使用默认提示词。")
-        else:
-            analysis_prompt_content = f"{self.config.robot_name}，你是一个情绪分析机器人，请分析用户的情绪。"
-
-        # 读取【回复】机器人的提示词文件内容
-        reply_prompt_file = self.reply_prompt_file_var.get()
-        if reply_prompt_file != "无":
-            try:
-                with open(reply_prompt_file, "r", encoding="utf-8") as f:
-                    reply_prompt_content = f.read().strip()
-            except FileNotFoundError:
-                reply_prompt_content = f"{self.config.robot_name}，你是一个回复机器人，请友好地回复用户。"
-                messagebox.showwarning("警告", f"提示词文件 {reply_prompt_file} 未找到，使用默认提示词。")
-        else:
-            reply_prompt_content = f"{self.config.robot_name}，你是一个回复机器人，请友好地回复用户。"
-
-        # 构建 Robot1（分析机器人）的系统提示词
-        robot1_system_prompt = (
-            f"你是一个名为{self.config.robot_name}的情绪分析机器人，你的任务是根据用户消息，决定机器人应该表现出的情绪，并生成提示词来控制机器人的行为。\n"
-            "你需要返回模型参数（temperature 和 topp）、机器人应该表现的情绪权重，以及提示词。\n"
-            "temperature 的范围是 0.0 到 2.0，topp 的范围是 0.0 到 1.0。\n"
-            "请严格按照以下格式返回内容，否则你的输出将被忽略，不会显示在界面或发送给机器人：\n"
-            "~!modelparam:{temperature:[<value>],topp:[<value>]}!~\n"
-            "~!emoweight:{happiness:[<value>];anger:[<value>];fear:[<value>];sadness:[<value>];disgust:[<value>];surprise:[<value>]}!~\n"
-            "~!prompt:[<提示词内容>]!~\n"
-            "例如：\n"
-            "~!modelparam:{temperature:[0.7],topp:[0.9]}!~\n"
-            "~!emoweight:{happiness:[0.5];anger:[0.1];fear:[0.2];sadness:[0.1];disgust:[0.0];surprise:[0.1]}!~\n"
-            f"~!prompt:[{analysis_prompt_content}]!~\n"
-            "请严格遵循上述格式返回内容，不要返回其他任何多余的内容！\n"
-        )
-
-        # 如果有上次机器人的回复，一起发送给 Robot1
-        if self.last_robot_reply:
-            user_message_with_reply = f"用户消息: {user_message}\n上次机器人回复: {self.last_robot_reply}\n用户名: {self.config.user_name}"
-        else:
-            user_message_with_reply = f"用户消息: {user_message}\n用户名: {self.config.user_name}"
-
-        threading.Thread(
-            target=self.call_robot1,
-            args=(robot1_system_prompt, user_message_with_reply, reply_prompt_content),
-            daemon=True
-        ).start()
-
-    def call_robot1(self, system_prompt, user_message, reply_prompt_content):
-        """调用 Robot1（情绪分析机器人）"""
-        try:
-            messages = [
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_message}
-            ]
-            response = requests.post(
-                self.config.api_url,
-                headers={"Authorization": f"Bearer {self.config.api_key}"},
-                json={"model": self.config.model, "messages": messages}
-            )
-            if response.status_code == 200:
-                robot1_response = response.json().get("choices", [{}])[0].get("message", {}).get("content", "")
-                model_params, emotion_weight, prompt = self.parse_robot1_response(robot1_response)
-                if model_params is None or emotion_weight is None or prompt is None:
-                    messagebox.showerror("错误", "Robot1 返回的内容格式不正确，请检查 Robot1 的输出是否符合指定格式！")
-                    return
-                self.show_emotion_window(emotion_weight, model_params, prompt)
-                # 调用回复机器人
-                self.call_robot(user_message, model_params, emotion_weight, reply_prompt_content)
-            else:
-                messagebox.showerror("错误", f"Robot1 请求失败: {response.text}")
-        except Exception as e:
-            messagebox.showerror("错误", f"Robot1 请求失败: {str(e)}")
-
-    def call_robot(self, user_message, robot1_model_params, robot1_emotion_weight, reply_prompt_content):
-        """调用回复机器人"""
-        try:
-            # 解析 Robot1 的模型参数
-            temperature = 0.7
-            topp = 0.9
-            if "temperature:" in robot1_model_params:
-                temp_start = robot1_model_params.find("temperature:[") + 13
-                temp_end = robot1_model_params.find("]", temp_start)
-                temperature = float(robot1_model_params[temp_start:temp_end])
-            if "topp:" in robot1_model_params:
-                topp_start = robot1_model_params.find("topp:[") + 6
-                topp_end = robot1_model_params.find("]", topp_start)
-                topp = float(robot1_model_params[topp_start:topp_end])
-
-            # 构建回复机器人的系统提示词
-            emotions = self.parse_emotion_weight(robot1_emotion_weight)
-            emotion_prompt = "\n".join([f"- {k}: {v}" for k, v in emotions.items()])
-            robot_system_prompt = (
-                f"你是一个名为{self.config.robot_name}的机器人，用户名是 {self.config.user_name}，根据以下情绪权重和提示词调整语气：\n"
-                f"情绪权重：\n{emotion_prompt}\n"
-                f"提示词：\n{reply_prompt_content}\n"
-                "请根据这些信息调整回复语气。\n"
-            )
-
-            # 如果开启上下文，将聊天记录作为上下文发送给回复机器人
-            if self.config.context_enabled:
-                context = self.chat_display.get("1.0", tk.END).strip()
-                robot_system_prompt += f"上下文：\n{context}\n"
-
-            messages = [
-                {"role": "system", "content": robot_system_prompt},
-                {"role": "user", "content": user_message}
-            ]
-            response = requests.post(
-                self.config.api_url,
-                headers={"Authorization": f"Bearer {self.config.api_key}"},
-                json={
-                    "model": self.config.model,
-                    "messages": messages,
-                    "temperature": temperature,
-                    "top_p": topp
-                }
-            )
-            if response.status_code == 200:
-                robot_response = response.json().get("choices", [{}])[0].get("message", {}).get("content", "")
-                robot_reply = self.extract_robot_reply(robot_response)
-                # 修复重复名称问题
-                if robot_reply.startswith(f"{self.config.robot_name}:"):
-                    self.chat_display.insert(tk.END, f"{robot_reply}\n")
-                else:
-                    self.chat_display.insert(tk.END, f"{self.config.robot_name}: {robot_reply}\n")
-                self.last_robot_reply = robot_reply
-                self.show_expected_window(robot1_model_params, robot1_emotion_weight)
-            else:
-                self.chat_display.insert(tk.END, f"{self.config.robot_name}: 错误: {response.text}\n")
-        except Exception as e:
-            self.chat_display.insert(tk.END, f"{self.config.robot_name}: 请求失败: {str(e)}\n")
-
-    def parse_robot1_response(self, response):
-        """解析 Robot1 的返回，提取模型参数、情绪权重和提示词"""
-        model_params = "~!modelparam:{temperature:[0.7],topp:[0.9]}!~"
-        emotion_weight = "~!emoweight:{happiness:[0.0];anger:[0.0];fear:[0.0];sadness:[0.0];disgust:[0.0];surprise:[0.0]}!~"
-        prompt = ""
-        if "~!modelparam:" not in response or "~!emoweight:" not in response or "~!prompt:[" not in response:
-            return None, None, None
-        if "~!modelparam:" in response:
-            start = response.find("~!modelparam:")
-            end = response.find("!~", start)
-            model_params = response[start:end + 2]
-        if "~!emoweight:" in response:
-            start = response.find("~!emoweight:")
-            end = response.find("!~", start)
-            emotion_weight = response[start:end + 2]
-        if "~!prompt:[" in response:
-            start = response.find("~!prompt:[") + 9
-            end = response.find("]!~", start)
-            prompt = response[start:end]
-            prompt = prompt.replace("[", "").replace("]", "")
-        return model_params, emotion_weight, prompt
-
-    def extract_robot_reply(self, response):
-        """提取机器人的回复内容"""
-        return response.strip()
-
-    def parse_emotion_weight(self, emotion_weight):
-        """解析情绪权重，返回字典"""
-        emotions = {}
-        pattern = r'(\w+):\[([\d.]+)\]'
-        matches = re.findall(pattern, emotion_weight)
-        for key, value in matches:
-            emotions[key] = float(value)
-        return emotions
-
-    def show_emotion_window(self, emotion_weight, model_params, prompt):
-        """展示 Robot1 的情绪权重、模型参数和提示词的窗口"""
-        if self.emotion_window is None or not self.emotion_window.winfo_exists():
-            self.emotion_window = Toplevel(self.root)
-            self.emotion_window.title(f"【分析】{self.config.robot_name}")
-            self.emotion_window.geometry("400x400")
-            # 模型参数文本框
-            ttk.Label(self.emotion_window, text="模型参数:").pack(pady=5)
-            self.emotion_param_text = scrolledtext.ScrolledText(self.emotion_window, wrap=tk.WORD, width=40, height=3)
-            self.emotion_param_text.pack(padx=5, pady=5)
-            # 情绪权重文本框
-            ttk.Label(self.emotion_window, text="情绪权重:").pack(pady=5)
-            self.emotion_text = scrolledtext.ScrolledText(self.emotion_window, wrap=tk.WORD, width=40, height=8)
-            self.emotion_text.pack(padx=5, pady=5)
-            # 提示词文本框
-            ttk.Label(self.emotion_window, text="提示词:").pack(pady=5)
-            self.prompt_text = scrolledtext.ScrolledText(self.emotion_window, wrap=tk.WORD, width=40, height=8)
-            self.prompt_text.pack(padx=5, pady=5)
-
-        # 解析模型参数
-        temperature = 0.7
-        topp = 0.9
-        if "temperature:" in model_params:
-            temp_start = model_params.find("temperature:[") + 13
-            temp_end = model_params.find("]", temp_start)
-            temperature = model_params[temp_start:temp_end]
-        if "topp:" in model_params:
-            topp_start = model_params.find("topp:[") + 6
-            topp_end = model_params.find("]", topp_start)
-            topp = model_params[topp_start:topp_end]
-
-        # 解析情绪权重
-        emotions = self.parse_emotion_weight(emotion_weight)
-
-        # 去掉提示词中的中括号
-        prompt = prompt.replace("[", "").replace("]", "")
-
-        # 更新模型参数文本框
-        self.emotion_param_text.config(state=tk.NORMAL)
-        self.emotion_param_text.delete(1.0, tk.END)
-        self.emotion_param_text.insert(tk.END, f"Temperature: {temperature}\nTop P: {topp}")
-        self.emotion_param_text.config(state=tk.DISABLED)
-
-        # 更新情绪权重文本框
-        self.emotion_text.config(state=tk.NORMAL)
-        self.emotion_text.delete(1.0, tk.END)
-        self.emotion_text.insert(tk.END, "\n".join([f"{k}: {v}" for k, v in emotions.items()]))
-        self.emotion_text.config(state=tk.DISABLED)
-
-        # 更新提示词文本框
-        self.prompt_text.config(state=tk.NORMAL)
-        self.prompt_text.delete(1.0, tk.END)
-        self.prompt_text.insert(tk.END, prompt)
-        self.prompt_text.config(state=tk.DISABLED)
-
-        self.emotion_window.lift()
-
-    def show_expected_window(self, expected_model_params, expected_emotion_weight):
-        """展示回复机器人的预期模型参数和预期情绪权重的窗口"""
-        if self.expected_window is None or not self.expected_window.winfo_exists():
-            self.expected_window = Toplevel(self.root)
-            self.expected_window.title(f"【回复】{self.config.robot_name}")
-            self.expected_window.geometry("400x300")
-            # 预期模型参数文本框
-            ttk.Label(self.expected_window, text="预期模型参数:").pack(pady=5)
-            self.expected_param_text = scrolledtext.ScrolledText(self.expected_window, wrap=tk.WORD, width=40, height=3)
-            self.expected_param_text.pack(padx=5, pady=5)
-            # 预期情绪权重文本框
-            ttk.Label(self.expected_window, text="预期情绪权重:").pack(pady=5)
-            self.expected_emotion_text = scrolledtext.ScrolledText(self.expected_window, wrap=tk.WORD, width=40, height=10)
-            self.expected_emotion_text.pack(padx=5, pady=5)
-
-        # 解析预期模型参数
-        expected_temperature = 0.7
-        expected_topp = 0.9
-        if "temperature:" in expected_model_params:
-            temp_start = expected_model_params.find("temperature:[") + 13
-            temp_end = expected_model_params.find("]", temp_start)
-            expected_temperature = expected_model_params[temp_start:temp_end]
-        if "topp:" in expected_model_params:
-            topp_start = expected_model_params.find("topp:[") + 6
-            topp_end = expected_model_params.find("]", topp_start)
-            expected_topp = expected_model_params[topp_start:topp_end]
-
-        # 解析预期情绪权重
-        expected_emotions = self.parse_emotion_weight(expected_emotion_weight)
-
-        # 更新预期模型参数文本框
-        self.expected_param_text.config(state=tk.NORMAL)
-        self.expected_param_text.delete(1.0, tk.END)
-        self.expected_param_text.insert(tk.END, f"Temperature: {expected_temperature}\nTop P: {expected_topp}")
-        self.expected_param_text.config(state=tk.DISABLED)
-
-        # 更新预期情绪权重文本框
-        self.expected_emotion_text.config(state=tk.NORMAL)
-        self.expected_emotion_text.delete(1.0, tk.END)
-        self.expected_emotion_text.insert(tk.END, "\n".join([f"{k}: {v}" for k, v in expected_emotions.items()]))
-        self.expected_emotion_text.config(state=tk.DISABLED)
-
-        self.expected_window.lift()
-
-# 运行程序
-if __name__ == "__main__":
-    root = tk.Tk()
-    app = RobotChatTool(root)
-    root.mainloop()
+import tkinter as tk
+from tkinter import ttk, scrolledtext, messagebox, filedialog, StringVar, BooleanVar, Toplevel
+import itertools
+import threading
+import time
+import traceback
+import uuid
+from collections import deque
+from config import Config
+from transport import HttpTransport
+from prompts import PromptStore
+from engine import PipelineEngine, PipelineError, Session, TurnCancelled
+from scheduler import TurnScheduler
+from store import ConversationStore
+from protocol import EMOTION_NAMES
+
+# 回复窗口的折线显示最近多少轮
+SPARKLINE_TURNS = 30
+
+
+class UiDispatcher:
+    """把后台线程的界面更新交给 Tk 主线程执行
+
+    后台线程只能调用 post()；队列从空变为非空时用 root.after 安排一次执行，interval_ms 内积累的调用
+    一次性执行完，队列为空时不占用主线程。
+    同一个 key 的调用只保留最新的一次，适合窗口刷新这类只关心最终状态的更新。
+    传入 metrics 时每批调用的耗时记为 render 阶段；timed=False 的调用（如模态对话框）不计入。
+    """
+
+    def __init__(self, root, interval_ms=30, metrics=None):
+        self.root = root
+        self.interval_ms = interval_ms
+        self.metrics = metrics
+        self._pending = {}  # key -> (fn, args, timed)，dict 保持插入顺序
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+        self._scheduled = False  # 是否已经安排了一次 _pump
+
+    def post(self, fn, *args, key=None, timed=True):
+        with self._lock:
+            if key is None:
+                key = next(self._counter)
+            else:
+                # 合并后的调用排到最后，保证和其他更新的相对顺序
+                self._pending.pop(key, None)
+            self._pending[key] = (fn, args, timed)
+            if self._scheduled:
+                return
+            self._scheduled = True
+        try:
+            self.root.after(self.interval_ms, self._pump)
+        except RuntimeError:
+            # 主循环还没有启动或已经退出；下一次 post 时再安排
+            with self._lock:
+                self._scheduled = False
+
+    def _pump(self):
+        with self._lock:
+            calls = list(self._pending.values())
+            self._pending.clear()
+            self._scheduled = False
+        elapsed = 0.0
+        rendered = False
+        for fn, args, timed in calls:
+            start = time.perf_counter()
+            try:
+                fn(*args)
+            except Exception:
+                traceback.print_exc()
+            if timed:
+                elapsed += time.perf_counter() - start
+                rendered = True
+        if rendered and self.metrics is not None:
+            self.metrics.observe("render", elapsed)
+
+
+class StreamRenderer:
+    """把流式回复的文本片段合并后批量追加到聊天框"""
+
+    def __init__(self, write, config):
+        self.write = write  # 把文本追加到聊天框的函数
+        self.config = config
+        self.name_prefix = f"{config.robot_name}:"
+        self.parts = []
+        self.pending = ""
+        self.header_done = False
+        self.last_flush = time.monotonic()
+
+    def feed(self, delta):
+        self.parts.append(delta)
+        if not self.header_done:
+            head = "".join(self.parts).lstrip()
+            # 还无法判断回复是否自带名字前缀时先不输出
+            if len(head) < len(self.name_prefix) and self.name_prefix.startswith(head):
+                return
+            self.header_done = True
+            # 修复重复名称问题
+            self.pending = head if head.startswith(self.name_prefix) else f"{self.config.robot_name}: {head}"
+        else:
+            self.pending += delta
+        now = time.monotonic()
+        if len(self.pending) >= self.config.stream_flush_chars or now - self.last_flush >= self.config.stream_flush_interval:
+            # 末尾空白先留着，回复结束时要和非流式模式一样去掉
+            text = self.pending.rstrip()
+            if text:
+                self.write(text)
+                self.pending = self.pending[len(text):]
+            self.last_flush = now
+
+    def finish(self, robot_line):
+        """回复结束：非流式模式下直接插入整行，流式模式下补上剩余部分"""
+        if not self.header_done:
+            self.write(f"{robot_line}\n")
+        else:
+            self.write(f"{self.pending.rstrip()}\n")
+
+    def abort(self, suffix=""):
+        """回复中途失败：已经输出了一部分时先换行，避免和错误信息挤在一行"""
+        if self.header_done:
+            self.write(f"{self.pending.rstrip()}{suffix}\n")
+        self.header_done = False
+        self.pending = ""
+
+
+class TranscriptView:
+    """聊天框的窗口化显示
+
+    聊天框只保留最近的若干条消息，更早的消息在滚动到顶部时从对话记录中分页加载。
+    每条已保存的消息在 Text 中有一个名为 turn<id> 的 mark，裁剪和加载都以它为边界。
+    """
+
+    def __init__(self, text, store, conversation_id, config):
+        self.text = text
+        self.store = store
+        self.conversation_id = conversation_id
+        self.config = config
+        self.turn_ids = deque()  # 聊天框中已保存消息的 id，从上到下
+        self.has_older = False
+        self.loading = False
+        self._pending_counter = itertools.count()
+        self.text.configure(yscrollcommand=self.on_yscroll)
+
+    def load_latest(self):
+        turns = self.store.load_before(self.conversation_id, None, self.config.transcript_window_turns)
+        for turn in turns:
+            mark = f"turn{turn.id}"
+            self.text.mark_set(mark, "end-1c")
+            self.text.mark_gravity(mark, tk.LEFT)
+            self.text.insert(tk.END, f"{turn.display_line()}\n")
+            self.turn_ids.append(turn.id)
+        self.has_older = bool(turns) and self.store.has_before(self.conversation_id, turns[0].id)
+        self.text.see(tk.END)
+
+    def new_mark_name(self):
+        """生成一个临时 mark 的名字，可以在后台线程中调用，之后交给主线程用 mark_pending 放置"""
+        return f"pending{next(self._pending_counter)}"
+
+    def mark_pending(self, mark=None):
+        """在聊天框末尾放一个临时 mark，标记一条还没保存的消息的开头"""
+        mark = mark or self.new_mark_name()
+        self.text.mark_set(mark, "end-1c")
+        self.text.mark_gravity(mark, tk.LEFT)
+        return mark
+
+    def _commit_mark(self, pending_mark, turn_id):
+        self.text.mark_set(f"turn{turn_id}", pending_mark)
+        self.text.mark_gravity(f"turn{turn_id}", tk.LEFT)
+        self.turn_ids.append(turn_id)
+
+    def commit(self, pending_marks, turn_id, reply_mark=None, reply_id=None):
+        """一轮对话保存后，把用户消息和回复开头的临时 mark 换成 turn<id>，然后裁剪超出窗口的旧消息
+
+        和从对话记录加载时一样，用户消息和回复各算一条。
+        """
+        if pending_marks and turn_id is not None:
+            self._commit_mark(pending_marks[0], turn_id)
+        if reply_mark is not None and reply_id is not None:
+            self._commit_mark(reply_mark, reply_id)
+        for mark in pending_marks + ([reply_mark] if reply_mark is not None else []):
+            self.text.mark_unset(mark)
+        self.trim()
+
+    def at_bottom(self):
+        return self.text.yview()[1] >= 0.999
+
+    def trim(self):
+        # 用户正在往上翻看时不裁剪，避免内容跳动
+        if not self.at_bottom():
+            return
+        while len(self.turn_ids) > self.config.transcript_window_turns:
+            oldest = self.turn_ids.popleft()
+            self.text.delete("1.0", f"turn{self.turn_ids[0]}")
+            self.text.mark_unset(f"turn{oldest}")
+            self.has_older = True
+
+    def on_yscroll(self, first, last):
+        self.text.vbar.set(first, last)
+        if float(first) <= 0.0 and self.has_older and not self.loading:
+            self.loading = True
+            self.text.after_idle(self.load_older)
+
+    def load_older(self):
+        """滚动到顶部时加载更早的一页消息，并保持当前看到的内容不动"""
+        try:
+            before_id = self.turn_ids[0] if self.turn_ids else None
+            turns = self.store.load_before(self.conversation_id, before_id, self.config.transcript_page_turns)
+            if not turns:
+                self.has_older = False
+                return
+            lines = [f"{turn.display_line()}\n" for turn in turns]
+            self.text.insert("1.0", "".join(lines))
+            line_no = 1
+            for turn, line in zip(turns, lines):
+                mark = f"turn{turn.id}"
+                self.text.mark_set(mark, f"{line_no}.0")
+                self.text.mark_gravity(mark, tk.LEFT)
+                line_no += line.count("\n")
+            if before_id is not None:
+                # 原来的第一条消息的 mark 在 1.0，向左的 gravity 让它留在了新插入内容的开头，移回原位
+                self.text.mark_set(f"turn{before_id}", f"{line_no}.0")
+            self.turn_ids.extendleft(reversed([turn.id for turn in turns]))
+            self.has_older = self.store.has_before(self.conversation_id, turns[0].id)
+            self.text.yview(f"{line_no}.0")
+        finally:
+            self.loading = False
+
+
+class EmotionChart:
+    """情绪权重的条形图，可以附带最近几轮的折线
+
+    图形只在创建时画一次，之后每轮只修改数值变化了的条形和文字的坐标，折线整体替换一次坐标，
+    每轮的界面开销固定，不随对话变长而增加。
+    """
+
+    COLORS = {
+        "happiness": "#f4b400", "anger": "#db4437", "fear": "#8e44ad",
+        "sadness": "#4285f4", "disgust": "#0f9d58", "surprise": "#ff6d00",
+    }
+    ROW_HEIGHT = 22
+    LABEL_WIDTH = 80
+    BAR_WIDTH = 200
+
+    def __init__(self, parent, history=0, spark_height=60):
+        self.history = history
+        self.spark_height = spark_height if history else 0
+        self.bars_height = self.ROW_HEIGHT * len(EMOTION_NAMES)
+        width = self.LABEL_WIDTH + self.BAR_WIDTH + 50
+        self.canvas = tk.Canvas(parent, width=width, height=self.bars_height + self.spark_height + 8,
+                                background="white", highlightthickness=0)
+        self.bars = {}
+        self.values = {}
+        self.labels = {}
+        for index, name in enumerate(EMOTION_NAMES):
+            top = index * self.ROW_HEIGHT + 4
+            self.canvas.create_text(4, top + 8, text=name, anchor="w")
+            self.bars[name] = self.canvas.create_rectangle(
+                self.LABEL_WIDTH, top + 2, self.LABEL_WIDTH, top + 14, fill=self.COLORS[name], outline=""
+            )
+            self.labels[name] = self.canvas.create_text(self.LABEL_WIDTH + 4, top + 8, text="", anchor="w")
+        self.lines = {}
+        self.shown_history = None
+        if history:
+            self.canvas.create_line(self.LABEL_WIDTH, self.bars_height + self.spark_height + 4,
+                                    self.LABEL_WIDTH + self.BAR_WIDTH, self.bars_height + self.spark_height + 4,
+                                    fill="#cccccc")
+            for name in EMOTION_NAMES:
+                # 先放两个点占位，有数据后再设置真正的坐标
+                self.lines[name] = self.canvas.create_line(0, 0, 0, 0, fill=self.COLORS[name], width=2, state="hidden")
+
+    def update(self, emotions, history=None):
+        for index, name in enumerate(EMOTION_NAMES):
+            value = emotions.get(name, 0.0)
+            if self.values.get(name) == value:
+                continue
+            self.values[name] = value
+            top = index * self.ROW_HEIGHT + 4
+            right = self.LABEL_WIDTH + value * self.BAR_WIDTH
+            self.canvas.coords(self.bars[name], self.LABEL_WIDTH, top + 2, right, top + 14)
+            self.canvas.coords(self.labels[name], right + 4, top + 8)
+            self.canvas.itemconfigure(self.labels[name], text=f"{value:.2f}")
+        if self.history and history is not None and history != self.shown_history:
+            self.shown_history = history
+            self._draw_history(history[-self.history:])
+
+    def _draw_history(self, history):
+        if len(history) < 2:
+            for line in self.lines.values():
+                self.canvas.itemconfigure(line, state="hidden")
+            return
+        step = self.BAR_WIDTH / (self.history - 1)
+        bottom = self.bars_height + self.spark_height + 4
+        for column, name in enumerate(EMOTION_NAMES):
+            points = []
+            for index, vector in enumerate(history):
+                points.append(self.LABEL_WIDTH + index * step)
+                points.append(bottom - vector[column] * (self.spark_height - 4))
+            self.canvas.coords(self.lines[name], *points)
+            self.canvas.itemconfigure(self.lines[name], state="normal")
+
+
+# 定义聊天工具类
+class RobotChatTool:
+    def __init__(self, root):
+        self.root = root
+        self.root.title("Robot Chat Tool")
+        self.config = Config.load_from_file()
+        self.transport = HttpTransport(self.config)  # 分析和回复共用的连接池
+        self.prompt_store = PromptStore()  # 提示词文件缓存，文件变化时才重新读取
+        # 对话记录：启动时接着上次的对话继续
+        self.store = ConversationStore(self.config.store_path) if self.config.store_path else None
+        conversation_id = self.store.latest_conversation() if self.store else None
+        self.engine = PipelineEngine(self.config, self.transport, self.prompt_store, self.store)
+        self.prompt_files = self.get_prompt_files()  # 获取当前目录下的所有 .txt 文件
+        self.session = Session(self.config, conversation_id or uuid.uuid4().hex)
+        self.engine.restore_session(self.session)
+        self.ui = UiDispatcher(self.root, metrics=self.engine.metrics)
+        self.scheduler = TurnScheduler(self.config.worker_threads, self.config.cancel_superseded)
+        self.unanswered = []  # 已经显示但还没有得到回复的用户消息，(消息, 临时 mark)
+        self.unanswered_lock = threading.Lock()
+        self.emotion_window = None  # 分析机器人的分析窗口
+        self.expected_window = None  # 回复机器人的回复窗口
+        self.stats_window = None  # 各阶段耗时和 token 用量的统计窗口
+        self.create_widgets()
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
+
+    def on_close(self):
+        """关闭窗口时取消还在进行的请求"""
+        self.scheduler.shutdown()
+        self.root.destroy()
+        if self.store is not None:
+            self.store.close()
+
+    def get_prompt_files(self):
+        """获取当前目录下所有 .txt 后缀的文件"""
+        prompt_files = self.prompt_store.list_files()
+        prompt_files.insert(0, "无")  # 添加“无”选项
+        return prompt_files
+
+    def refresh_prompt_files(self):
+        """展开下拉框时刷新提示词文件列表，目录没有变化时不会重新扫描"""
+        self.prompt_files = self.get_prompt_files()
+        self.analysis_prompt_file_combobox.configure(values=self.prompt_files)
+        self.reply_prompt_file_combobox.configure(values=self.prompt_files)
+
+    def create_widgets(self):
+        # 配置框
+        config_frame = ttk.LabelFrame(self.root, text="配置", padding=5)
+        config_frame.pack(padx=10, pady=5, fill="x")
+
+        ttk.Label(config_frame, text="API URL:").grid(row=0, column=0, sticky="w")
+        self.api_url_entry = ttk.Entry(config_frame, width=50)
+        self.api_url_entry.grid(row=0, column=1, padx=5, pady=2)
+        self.api_url_entry.insert(0, self.config.api_url)
+
+        ttk.Label(config_frame, text="API Key:").grid(row=1, column=0, sticky="w")
+        self.api_key_entry = ttk.Entry(config_frame, width=50)
+        self.api_key_entry.grid(row=1, column=1, padx=5, pady=2)
+        self.api_key_entry.insert(0, self.config.api_key)
+
+        ttk.Label(config_frame, text="模型:").grid(row=2, column=0, sticky="w")
+        self.model_entry = ttk.Entry(config_frame, width=50)
+        self.model_entry.grid(row=2, column=1, padx=5, pady=2)
+        self.model_entry.insert(0, self.config.model)
+
+        ttk.Label(config_frame, text="用户名:").grid(row=3, column=0, sticky="w")
+        self.user_name_entry = ttk.Entry(config_frame, width=50)
+        self.user_name_entry.grid(row=3, column=1, padx=5, pady=2)
+        self.user_name_entry.insert(0, self.config.user_name)
+
+        ttk.Label(config_frame, text="机器人名字:").grid(row=4, column=0, sticky="w")
+        self.robot_name_entry = ttk.Entry(config_frame, width=50)
+        self.robot_name_entry.grid(row=4, column=1, padx=5, pady=2)
+        self.robot_name_entry.insert(0, self.config.robot_name)
+
+        # 分析机器人的提示词文件选择框
+        ttk.Label(config_frame, text="【分析】提示词文件:").grid(row=5, column=0, sticky="w")
+        self.analysis_prompt_file_var = StringVar()
+        self.analysis_prompt_file_combobox = ttk.Combobox(
+            config_frame,
+            textvariable=self.analysis_prompt_file_var,
+            values=self.prompt_files,
+            state='readonly',
+            postcommand=self.refresh_prompt_files
+        )
+        self.analysis_prompt_file_combobox.grid(row=5, column=1, padx=5, pady=2, sticky="w")
+        self.analysis_prompt_file_combobox.set(self.config.analysis_prompt_file)
+
+        # 回复机器人的提示词文件选择框
+        ttk.Label(config_frame, text="【回复】提示词文件:").grid(row=6, column=0, sticky="w")
+        self.reply_prompt_file_var = StringVar()
+        self.reply_prompt_file_combobox = ttk.Combobox(
+            config_frame,
+            textvariable=self.reply_prompt_file_var,
+            values=self.prompt_files,
+            state='readonly',
+            postcommand=self.refresh_prompt_files
+        )
+        self.reply_prompt_file_combobox.grid(row=6, column=1, padx=5, pady=2, sticky="w")
+        self.reply_prompt_file_combobox.set(self.config.reply_prompt_file)
+
+        # 上下文复选框
+        self.context_enabled_var = BooleanVar(value=self.config.context_enabled)
+        ttk.Checkbutton(config_frame, text="开启上下文", variable=self.context_enabled_var).grid(row=7, column=0, sticky="w")
+
+        # 流式回复复选框
+        self.stream_enabled_var = BooleanVar(value=self.config.stream_enabled)
+        ttk.Checkbutton(config_frame, text="流式回复", variable=self.stream_enabled_var).grid(row=7, column=1, sticky="w")
+
+        # 合并模式复选框
+        self.fused_enabled_var = BooleanVar(value=self.config.fused_enabled)
+        ttk.Checkbutton(config_frame, text="合并分析与回复", variable=self.fused_enabled_var).grid(row=8, column=0, sticky="w")
+
+        save_config_button = ttk.Button(config_frame, text="保存配置", command=self.save_config)
+        save_config_button.grid(row=8, column=1, pady=5, sticky="e")
+
+        # 聊天框
+        chat_frame = ttk.LabelFrame(self.root, text="聊天", padding=5)
+        chat_frame.pack(padx=10, pady=5, fill="both", expand=True)
+        self.chat_display = scrolledtext.ScrolledText(chat_frame, wrap=tk.WORD, width=60, height=20)
+        self.chat_display.pack(padx=5, pady=5, fill="both", expand=True)
+        self.transcript = None
+        if self.store is not None:
+            self.transcript = TranscriptView(self.chat_display, self.store, self.session.conversation_id, self.config)
+            self.transcript.load_latest()
+
+        # 输入框
+        input_frame = ttk.Frame(self.root)
+        input_frame.pack(padx=10, pady=5, fill="x")
+        self.user_input = ttk.Entry(input_frame)
+        self.user_input.pack(side="left", fill="x", expand=True, padx=(0, 5))
+        send_button = ttk.Button(input_frame, text="发送", command=self.send_message)
+        send_button.pack(side="right")
+        stats_button = ttk.Button(input_frame, text="统计", command=self.show_stats_window)
+        stats_button.pack(side="right", padx=(0, 5))
+
+    def save_config(self):
+        self.config.api_url = self.api_url_entry.get()
+        self.config.api_key = self.api_key_entry.get()
+        self.config.model = self.model_entry.get()
+        self.config.user_name = self.user_name_entry.get()
+        self.config.robot_name = self.robot_name_entry.get()
+        self.config.analysis_prompt_file = self.analysis_prompt_file_var.get()
+        self.config.reply_prompt_file = self.reply_prompt_file_var.get()
+        self.config.context_enabled = self.context_enabled_var.get()
+        self.config.stream_enabled = self.stream_enabled_var.get()
+        self.config.fused_enabled = self.fused_enabled_var.get()
+        self.config.save_to_file()
+        self.transport.close()  # API 地址可能已变化，旧连接池不再需要
+        messagebox.showinfo("提示", "配置已保存！")
+
+    def send_message(self):
+        user_message = self.user_input.get()
+        if not user_message:
+            return
+        pending_mark = self.transcript.mark_pending() if self.transcript else None
+        self.chat_display.insert(tk.END, f"{self.config.user_name}: {user_message}\n")
+        self.user_input.delete(0, tk.END)
+
+        # 读取两个机器人的提示词文件内容
+        analysis_prompt_content, reply_prompt_content, missing = self.engine.load_prompts(
+            self.analysis_prompt_file_var.get(), self.reply_prompt_file_var.get()
+        )
+        for prompt_file in missing:
+            messagebox.showwarning("警告", f"提示词文件 {prompt_file} 未找到，使用默认提示词。")
+
+        with self.unanswered_lock:
+            self.unanswered.append((user_message, pending_mark))
+        # 同一对话的消息按顺序执行；新消息会取消还没完成的旧请求，旧消息并入新的一轮
+        self.scheduler.submit(
+            "main",
+            lambda cancel: self.process_message(analysis_prompt_content, reply_prompt_content, cancel)
+        )
+
+    def write_chat(self, text):
+        """从后台线程向聊天框追加文本"""
+        self.ui.post(self.chat_display.insert, tk.END, text)
+
+    def process_message(self, analysis_prompt_content, reply_prompt_content, cancel):
+        """在工作线程中执行一轮 分析 -> 回复，界面更新都交给主线程"""
+        with self.unanswered_lock:
+            pending_messages = list(self.unanswered)
+        if not pending_messages:
+            return
+        user_message = "\n".join(message for message, _ in pending_messages)
+        renderer = StreamRenderer(self.write_chat, self.config)
+        reply_mark = None
+        if self.transcript is not None:
+            # 回复的开头，排在回复的第一次写入之前
+            reply_mark = self.transcript.new_mark_name()
+            self.ui.post(self.transcript.mark_pending, reply_mark)
+        try:
+            result = self.engine.run_turn(
+                self.session, user_message, analysis_prompt_content, reply_prompt_content,
+                on_analysis=lambda analysis: self.ui.post(self.show_emotion_window, analysis, key="emotion_window"),
+                on_delta=renderer.feed, cancel=cancel
+            )
+        except TurnCancelled:
+            renderer.abort("……")
+            if reply_mark is not None:
+                self.ui.post(self.chat_display.mark_unset, reply_mark)
+            return
+        except PipelineError as e:
+            with self.unanswered_lock:
+                del self.unanswered[:len(pending_messages)]
+            if self.transcript is not None:
+                self.ui.post(self.transcript.commit, [mark for _, mark in pending_messages], None, reply_mark)
+            if e.stage == "analysis":
+                # 模态对话框会一直阻塞到用户关闭，不计入渲染耗时
+                self.ui.post(messagebox.showerror, "错误", str(e), timed=False)
+            else:
+                renderer.abort()
+                self.write_chat(f"{self.config.robot_name}: {str(e)}\n")
+            return
+        with self.unanswered_lock:
+            del self.unanswered[:len(pending_messages)]
+        renderer.finish(self.engine.format_robot_line(result.reply))
+        if self.transcript is not None:
+            pending_marks = [mark for _, mark in pending_messages]
+            self.ui.post(self.transcript.commit, pending_marks, result.turn_id, reply_mark, result.reply_id)
+        timeline = self.session.timeline
+        self.ui.post(self.show_expected_window, result.mood, timeline.recent(SPARKLINE_TURNS), timeline.stats(),
+                     key="expected_window")
+
+    def show_emotion_window(self, analysis):
+        """展示 Robot1 的情绪权重、模型参数和提示词的窗口，只更新发生变化的部分"""
+        if self.emotion_window is None or not self.emotion_window.winfo_exists():
+            self.emotion_window = Toplevel(self.root)
+            self.emotion_window.title(f"【分析】{self.config.robot_name}")
+            self.emotion_window.geometry("400x400")
+            # 模型参数
+            ttk.Label(self.emotion_window, text="模型参数:").pack(pady=5)
+            self.emotion_param_var = StringVar()
+            ttk.Label(self.emotion_window, textvariable=self.emotion_param_var).pack(padx=5)
+            # 情绪权重
+            ttk.Label(self.emotion_window, text="情绪权重:").pack(pady=5)
+            self.emotion_chart = EmotionChart(self.emotion_window)
+            self.emotion_chart.canvas.pack(padx=5, pady=5)
+            # 提示词文本框
+            ttk.Label(self.emotion_window, text="提示词:").pack(pady=5)
+            self.prompt_text = scrolledtext.ScrolledText(self.emotion_window, wrap=tk.WORD, width=40, height=6)
+            self.prompt_text.pack(padx=5, pady=5)
+            self.prompt_text.config(state=tk.DISABLED)
+            self.shown_prompt = None
+
+        self.emotion_param_var.set(f"Temperature: {analysis.temperature}    Top P: {analysis.top_p}")
+        self.emotion_chart.update(analysis.emotions())
+        if analysis.prompt != self.shown_prompt:
+            self.shown_prompt = analysis.prompt
+            self.prompt_text.config(state=tk.NORMAL)
+            self.prompt_text.delete(1.0, tk.END)
+            self.prompt_text.insert(tk.END, analysis.prompt)
+            self.prompt_text.config(state=tk.DISABLED)
+
+        self.emotion_window.lift()
+
+    def show_expected_window(self, mood, history=None, stats=None):
+        """展示回复机器人实际使用的模型参数、情绪权重和最近几轮的情绪走势
+
+        history 和 stats 在工作线程中从情绪轨迹取出，这里只负责绘制。
+        """
+        if self.expected_window is None or not self.expected_window.winfo_exists():
+            self.expected_window = Toplevel(self.root)
+            self.expected_window.title(f"【回复】{self.config.robot_name}")
+            self.expected_window.geometry("400x360")
+            # 预期模型参数
+            ttk.Label(self.expected_window, text="预期模型参数:").pack(pady=5)
+            self.expected_param_var = StringVar()
+            ttk.Label(self.expected_window, textvariable=self.expected_param_var).pack(padx=5)
+            # 预期情绪权重和走势
+            ttk.Label(self.expected_window, text="预期情绪权重（折线为最近几轮）:").pack(pady=5)
+            self.expected_chart = EmotionChart(self.expected_window, history=SPARKLINE_TURNS)
+            self.expected_chart.canvas.pack(padx=5, pady=5)
+            self.expected_stats_var = StringVar()
+            ttk.Label(self.expected_window, textvariable=self.expected_stats_var).pack(padx=5, pady=5)
+
+        self.expected_param_var.set(f"Temperature: {mood.temperature}    Top P: {mood.top_p}")
+        self.expected_chart.update(mood.emotions(), history)
+        if stats is not None:
+            self.expected_stats_var.set(
+                f"共 {stats['turns']} 轮，整体情绪偏向 {stats['dominant']}，"
+                f"平均波动 {sum(stats['volatility'].values()) / len(stats['volatility']):.3f}"
+            )
+
+        self.expected_window.lift()
+
+    def show_stats_window(self):
+        """展示各阶段耗时和 token 用量的统计窗口，打开期间每秒刷新一次"""
+        if self.stats_window is not None and self.stats_window.winfo_exists():
+            self.stats_window.lift()
+            return
+        self.stats_window = Toplevel(self.root)
+        self.stats_window.title("统计")
+        self.stats_window.geometry("520x420")
+        self.stats_text = scrolledtext.ScrolledText(self.stats_window, wrap=tk.NONE, width=64, height=20, font=("Courier", 10))
+        self.stats_text.pack(padx=5, pady=5, fill="both", expand=True)
+        export_button = ttk.Button(self.stats_window, text="导出 Prometheus", command=self.export_metrics)
+        export_button.pack(pady=5)
+        self.refresh_stats_window()
+
+    def refresh_stats_window(self):
+        if self.stats_window is None or not self.stats_window.winfo_exists():
+            return
+        snapshot = self.engine.metrics.snapshot()
+        lines = [f"{'阶段':<10}{'次数':>6}{'平均(ms)':>10}{'p50(ms)':>10}{'p95(ms)':>10}{'p99(ms)':>10}"]
+        for stage, data in snapshot["stages"].items():
+            lines.append(f"{stage:<12}{data['count']:>8}{data['avg'] * 1000:>10.1f}{data['p50'] * 1000:>10.1f}"
+                         f"{data['p95'] * 1000:>10.1f}{data['p99'] * 1000:>10.1f}")
+        lines.append("")
+        lines.append("token 用量:")
+        for name, value in snapshot["tokens"].items():
+            lines.append(f"  {name}: {value}")
+        lines.append("")
+        lines.append("事件:")
+        for name, value in snapshot["counters"].items():
+            lines.append(f"  {name}: {value}")
+        lines.append("")
+        cache = self.engine.analysis_cache.stats()
+        lines.append(f"分析缓存: {cache['entries']} 条，命中 {cache['hits']}，未命中 {cache['misses']}，"
+                     f"命中率 {cache['hit_rate']:.1%}")
+        lines.append("")
+        lines.append("端点:")
+        for endpoint in self.engine.router.stats():
+            latency = "-" if endpoint["latency"] is None else f"{endpoint['latency'] * 1000:.0f}ms"
+            state = "冷却中" if endpoint["cooling_down"] else "正常"
+            lines.append(f"  {endpoint['name']}: {latency}, 请求 {endpoint['requests']}, 失败 {endpoint['errors']}, {state}")
+        position = self.stats_text.yview()[0]
+        self.stats_text.config(state=tk.NORMAL)
+        self.stats_text.delete(1.0, tk.END)
+        self.stats_text.insert(tk.END, "\n".join(lines))
+        self.stats_text.config(state=tk.DISABLED)
+        self.stats_text.yview_moveto(position)
+        self.stats_window.after(1000, self.refresh_stats_window)
+
+    def export_metrics(self):
+        """把统计数据导出为 Prometheus 文本格式"""
+        path = filedialog.asksaveasfilename(
+            parent=self.stats_window, defaultextension=".prom",
+            filetypes=[("Prometheus", "*.prom"), ("所有文件", "*.*")]
+        )
+        if not path:
+            return
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(self.engine.metrics.to_prometheus() + self.engine.analysis_cache.to_prometheus())
+
+# 运行程序
+if __name__ == "__main__":
+    root = tk.Tk()
+    app = RobotChatTool(root)
+    root.mainloop()
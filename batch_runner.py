@@ -0,0 +1,79 @@
+"""批量回放对话：从 JSONL 文件读取对话，通过无界面的流水线并发执行
+
+输入文件每行一个对话，例如：
+    {"id": "case-1", "messages": ["你好", "今天有点难过"]}
+输出文件每行一个对话的结果，顺序按完成先后。
+"""
+import argparse
+import asyncio
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+from config import Config
+from engine import PipelineEngine, PipelineError, Session
+
+
+async def run_conversation(engine, conversation, prompts, semaphore):
+    """按顺序执行一个对话的所有消息，同一对话内的轮次不能并发"""
+    analysis_prompt_content, reply_prompt_content = prompts
+    session = Session(engine.config)
+    turns = []
+    async with semaphore:
+        for user_message in conversation.get("messages", []):
+            try:
+                result = await engine.arun_turn(session, user_message, analysis_prompt_content, reply_prompt_content)
+            except PipelineError as e:
+                turns.append({"user": user_message, "stage": e.stage, "error": str(e)})
+                continue
+            turns.append(result.to_dict())
+    return {"id": conversation.get("id"), "turns": turns}
+
+
+async def run_batch(engine, conversations, output_file, concurrency):
+    analysis_prompt_content, reply_prompt_content, missing = engine.load_prompts()
+    for prompt_file in missing:
+        print(f"警告: 提示词文件 {prompt_file} 未找到，使用默认提示词。")
+    # arun_turn 把阻塞请求放进默认线程池，线程数要跟得上并发数
+    asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=concurrency))
+    semaphore = asyncio.Semaphore(concurrency)
+    tasks = [
+        asyncio.create_task(run_conversation(engine, conversation, (analysis_prompt_content, reply_prompt_content), semaphore))
+        for conversation in conversations
+    ]
+    done = 0
+    with open(output_file, "w", encoding="utf-8") as f:
+        for task in asyncio.as_completed(tasks):
+            f.write(json.dumps(await task, ensure_ascii=False) + "\n")
+            f.flush()
+            done += 1
+            print(f"\r已完成 {done}/{len(tasks)}", end="", flush=True)
+    print()
+
+
+def load_conversations(input_file):
+    conversations = []
+    with open(input_file, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                conversations.append(json.loads(line))
+    return conversations
+
+
+def main():
+    parser = argparse.ArgumentParser(description="通过情绪流水线批量回放 JSONL 对话")
+    parser.add_argument("input", help="输入的 JSONL 文件，每行一个对话")
+    parser.add_argument("-o", "--output", default="batch_output.jsonl", help="输出的 JSONL 文件")
+    parser.add_argument("-c", "--concurrency", type=int, default=4, help="同时进行的对话数")
+    parser.add_argument("--config", default="config.json", help="配置文件路径")
+    args = parser.parse_args()
+
+    config = Config.load_from_file(args.config)
+    # 连接池至少要容纳所有并发的对话，否则请求会在池上排队
+    config.pool_size = max(config.pool_size, args.concurrency)
+    engine = PipelineEngine(config)
+    asyncio.run(run_batch(engine, load_conversations(args.input), args.output, args.concurrency))
+
+
+if __name__ == "__main__":
+    main()
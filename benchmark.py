@@ -0,0 +1,191 @@
+"""离线压测：启动本地模拟服务，让 分析 -> 回复 流水线跑 N 个并发对话
+
+报告各阶段延迟的 p50/p95/p99、吞吐量，以及随着历史增长每一轮发送的请求字节数。
+"""
+import argparse
+import asyncio
+import json
+import math
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from config import Config
+from engine import PipelineEngine, PipelineError, Session
+from mock_server import MockOptions, start_mock_server
+from transport import HttpTransport
+
+SAMPLE_MESSAGES = ["你好", "今天工作好累", "不过晚上吃到了好吃的", "你觉得我该早点睡吗", "明天还要早起开会", "谢谢你陪我聊天"]
+
+
+class CountingTransport(HttpTransport):
+    """按线程记录请求体字节数的传输层
+
+    推测执行的回复请求在另一个线程中发出，不计入所在这一轮的字节数。
+    """
+
+    def __init__(self, config):
+        super().__init__(config)
+        self.local = threading.local()
+
+    def post(self, url, api_key, payload, stream=False):
+        sent = getattr(self.local, "bytes_sent", 0)
+        self.local.bytes_sent = sent + len(json.dumps(payload).encode("utf-8"))
+        return super().post(url, api_key, payload, stream)
+
+    def take_bytes_sent(self):
+        sent = getattr(self.local, "bytes_sent", 0)
+        self.local.bytes_sent = 0
+        return sent
+
+
+def percentile(values, p):
+    """最近秩法计算百分位数"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, math.ceil(p / 100.0 * len(ordered)) - 1))
+    return ordered[index]
+
+
+class BenchmarkStats:
+    def __init__(self):
+        self.latencies = {"analysis": [], "reply": [], "first_token": [], "turn": []}
+        self.bytes_by_turn = {}  # 轮次 -> [每个对话这一轮发送的字节数]
+        self.errors = 0
+        self.turns = 0
+        self.lock = threading.Lock()
+
+    def record(self, turn_index, timings, bytes_sent):
+        with self.lock:
+            self.turns += 1
+            for stage, value in timings.items():
+                self.latencies[stage].append(value)
+            self.bytes_by_turn.setdefault(turn_index, []).append(bytes_sent)
+
+    def summary(self, elapsed):
+        stages = {}
+        for stage, values in self.latencies.items():
+            if values:
+                stages[stage] = {
+                    "count": len(values),
+                    "p50_ms": percentile(values, 50) * 1000,
+                    "p95_ms": percentile(values, 95) * 1000,
+                    "p99_ms": percentile(values, 99) * 1000,
+                }
+        return {
+            "turns": self.turns,
+            "errors": self.errors,
+            "elapsed_s": elapsed,
+            "turns_per_s": self.turns / elapsed if elapsed else 0.0,
+            "stages": stages,
+            "bytes_per_turn": {
+                index: sum(values) / len(values) for index, values in sorted(self.bytes_by_turn.items())
+            },
+        }
+
+
+def run_turn_timed(engine, session, user_message, prompts):
+    """在工作线程中执行一轮并记录各阶段耗时，返回 (各阶段耗时, 发送的字节数)"""
+    start = time.perf_counter()
+    marks = {}
+
+    def on_analysis(analysis):
+        marks["analysis"] = time.perf_counter()
+
+    def on_delta(delta):
+        marks.setdefault("first_token", time.perf_counter())
+
+    engine.transport.take_bytes_sent()
+    try:
+        engine.run_turn(session, user_message, prompts[0], prompts[1], on_analysis=on_analysis, on_delta=on_delta)
+    finally:
+        bytes_sent = engine.transport.take_bytes_sent()
+    end = time.perf_counter()
+    analysis_done = marks.get("analysis", start)
+    timings = {"analysis": analysis_done - start, "reply": end - analysis_done, "turn": end - start}
+    if "first_token" in marks:
+        timings["first_token"] = marks["first_token"] - start
+    return timings, bytes_sent
+
+
+async def run_conversation(engine, prompts, turns, stats, semaphore):
+    session = Session(engine.config)
+    async with semaphore:
+        for turn_index in range(turns):
+            user_message = SAMPLE_MESSAGES[turn_index % len(SAMPLE_MESSAGES)]
+            try:
+                timings, bytes_sent = await asyncio.to_thread(run_turn_timed, engine, session, user_message, prompts)
+            except PipelineError:
+                with stats.lock:
+                    stats.errors += 1
+                continue
+            stats.record(turn_index + 1, timings, bytes_sent)
+
+
+async def run_benchmark(engine, conversations, turns, concurrency):
+    asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=concurrency))
+    analysis_prompt_content, reply_prompt_content, _ = engine.load_prompts("无", "无")
+    stats = BenchmarkStats()
+    semaphore = asyncio.Semaphore(concurrency)
+    start = time.perf_counter()
+    await asyncio.gather(*[
+        run_conversation(engine, (analysis_prompt_content, reply_prompt_content), turns, stats, semaphore)
+        for _ in range(conversations)
+    ])
+    return stats.summary(time.perf_counter() - start)
+
+
+def print_report(summary):
+    print(f"完成 {summary['turns']} 轮，失败 {summary['errors']} 轮，耗时 {summary['elapsed_s']:.2f}s，"
+          f"吞吐 {summary['turns_per_s']:.2f} 轮/秒")
+    print(f"{'阶段':<12}{'次数':>8}{'p50(ms)':>12}{'p95(ms)':>12}{'p99(ms)':>12}")
+    for stage, data in summary["stages"].items():
+        print(f"{stage:<12}{data['count']:>8}{data['p50_ms']:>12.1f}{data['p95_ms']:>12.1f}{data['p99_ms']:>12.1f}")
+    print("每轮发送的字节数（按轮次平均）：")
+    for index, value in summary["bytes_per_turn"].items():
+        print(f"  第 {index} 轮: {value:.0f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="使用本地模拟服务对情绪流水线进行压测")
+    parser.add_argument("-n", "--conversations", type=int, default=20, help="对话数")
+    parser.add_argument("-t", "--turns", type=int, default=6, help="每个对话的轮数")
+    parser.add_argument("-c", "--concurrency", type=int, default=4, help="同时进行的对话数")
+    parser.add_argument("--latency", type=float, default=0.05, help="模拟服务的首字节延迟（秒）")
+    parser.add_argument("--token-rate", type=float, default=200.0, help="模拟服务每秒输出的 token 数")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="模拟服务返回 503 的概率")
+    parser.add_argument("--stream", action="store_true", help="回复使用流式输出")
+    parser.add_argument("--context", action="store_true", help="开启上下文")
+    parser.add_argument("--fused", action="store_true", help="使用合并模式")
+    parser.add_argument("--speculative", action="store_true", help="使用推测执行")
+    parser.add_argument("--cache", action="store_true", help="开启分析结果缓存；默认关闭，避免缓存命中拉低分析耗时")
+    parser.add_argument("--json", help="把结果另存为 JSON 文件")
+    args = parser.parse_args()
+
+    server, url = start_mock_server(MockOptions(args.latency, args.token_rate, args.error_rate, seed=0))
+    config = Config(
+        api_url=url,
+        api_key="benchmark",
+        model="mock",
+        context_enabled=args.context,
+        stream_enabled=args.stream,
+        fused_enabled=args.fused,
+        speculative_enabled=args.speculative,
+        analysis_cache_enabled=args.cache,
+        store_path="",
+        pool_size=max(args.concurrency, 4),
+    )
+    engine = PipelineEngine(config, CountingTransport(config))
+    try:
+        summary = asyncio.run(run_benchmark(engine, args.conversations, args.turns, args.concurrency))
+    finally:
+        server.shutdown()
+    print_report(summary)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(summary, f, ensure_ascii=False, indent=4)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+def make_cache_key(url, payload):
+    """对完整的分析请求（端点、模型、消息）做哈希，作为缓存键"""
+    data = json.dumps({"url": url, "payload": payload}, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+class AnalysisCache:
+    """情绪分析结果的缓存：内存 LRU + 可选的磁盘层，按条数和 TTL 淘汰"""
+
+    # 每写入这么多次检查一次磁盘层的大小
+    DISK_PRUNE_INTERVAL = 64
+
+    def __init__(self, max_entries=512, ttl=3600.0, cache_dir="", disk_max_entries=10000):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.cache_dir = cache_dir
+        self.disk_max_entries = disk_max_entries
+        self.hits = 0
+        self.misses = 0
+        self._disk_writes = 0
+        self._entries = OrderedDict()  # key -> (写入时间, 值)
+        self._lock = threading.Lock()
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def _expired(self, created):
+        return self.ttl > 0 and time.time() - created > self.ttl
+
+    def _disk_path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def _read_disk(self, key):
+        try:
+            with open(self._disk_path(key), "r", encoding="utf-8") as f:
+                record = json.load(f)
+            return record["created"], record["value"]
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def _write_disk(self, key, created, value):
+        # 先写临时文件再替换，避免并发读到写了一半的文件
+        path = self._disk_path(key)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"created": created, "value": value}, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except OSError:
+            pass
+
+    def _remove_disk(self, key):
+        try:
+            os.remove(self._disk_path(key))
+        except OSError:
+            pass
+
+    def _prune_disk(self):
+        """磁盘层超过上限时删除最旧的文件，同时清理过期的文件"""
+        try:
+            names = [name for name in os.listdir(self.cache_dir) if name.endswith(".json")]
+        except OSError:
+            return
+        files = []
+        for name in names:
+            try:
+                files.append((os.path.getmtime(os.path.join(self.cache_dir, name)), name))
+            except OSError:
+                continue
+        files.sort()
+        excess = len(files) - self.disk_max_entries
+        for index, (mtime, name) in enumerate(files):
+            if index < excess or self._expired(mtime):
+                self._remove_disk(name[:-5])
+
+    def _put_memory(self, key, created, value):
+        self._entries[key] = (created, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def get(self, key):
+        """返回缓存的值，没有命中时返回 None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if not self._expired(entry[0]):
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                del self._entries[key]
+        if self.cache_dir:
+            entry = self._read_disk(key)
+            if entry is not None:
+                if not self._expired(entry[0]):
+                    with self._lock:
+                        self._put_memory(key, entry[0], entry[1])
+                        self.hits += 1
+                    return entry[1]
+                self._remove_disk(key)
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, value):
+        created = time.time()
+        with self._lock:
+            self._put_memory(key, created, value)
+        if self.cache_dir:
+            self._write_disk(key, created, value)
+            with self._lock:
+                self._disk_writes += 1
+                prune = self._disk_writes % self.DISK_PRUNE_INTERVAL == 0
+            if prune:
+                self._prune_disk()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+        if self.cache_dir:
+            for name in os.listdir(self.cache_dir):
+                if name.endswith(".json"):
+                    self._remove_disk(name[:-5])
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
+
+    def to_prometheus(self):
+        """导出为 Prometheus 文本格式，接在 Metrics.to_prometheus 的输出后面"""
+        stats = self.stats()
+        return (
+            "# TYPE heartchat_analysis_cache_hits_total counter\n"
+            f"heartchat_analysis_cache_hits_total {stats['hits']}\n"
+            "# TYPE heartchat_analysis_cache_misses_total counter\n"
+            f"heartchat_analysis_cache_misses_total {stats['misses']}\n"
+            "# TYPE heartchat_analysis_cache_entries gauge\n"
+            f"heartchat_analysis_cache_entries {stats['entries']}\n"
+        )
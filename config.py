@@ -0,0 +1,84 @@
+import json
+import os
+from typing import List
+from pydantic import BaseModel
+
+
+# 上游端点配置
+class EndpointConfig(BaseModel):
+    url: str
+    api_key: str = ""
+    model: str
+    name: str = ""  # 显示用的名字，留空则使用 模型@地址
+
+
+# 定义配置模型
+class Config(BaseModel):
+    api_url: str = "https://api.example.com/v1/chat/completions"
+    api_key: str = "your_api_key_here"
+    model: str = "default_model"
+    user_name: str = "用户"
+    robot_name: str = "AI"
+    analysis_prompt_file: str = "无"  # 分析机器人的提示词文件
+    reply_prompt_file: str = "无"     # 回复机器人的提示词文件
+    context_enabled: bool = False
+    context_token_budget: int = 2000  # 上下文最多占用的 token 数（估算值）
+    context_max_turns: int = 20      # 上下文最多保留的消息条数
+    context_summary_enabled: bool = False  # 是否把移出窗口的旧对话压缩成摘要
+    stream_enabled: bool = False     # 回复机器人是否使用流式输出
+    stream_flush_chars: int = 24     # 流式输出累计多少个字符后刷新一次聊天框
+    stream_flush_interval: float = 0.05  # 流式输出最长多久刷新一次聊天框（秒）
+    fused_enabled: bool = False      # 合并模式：一次请求同时返回分析结果和回复
+    fused_use_previous_params: bool = True  # 合并模式下沿用上一轮分析得到的 temperature / topp
+    fused_temperature: float = 0.7   # 合并模式下没有上一轮结果时使用的 temperature
+    fused_top_p: float = 0.9         # 合并模式下没有上一轮结果时使用的 topp
+    speculative_enabled: bool = False  # 推测执行：用上一轮的情绪权重提前发出回复请求
+    speculative_threshold: float = 0.15  # 情绪向量的变化（欧氏距离）不超过该值时采纳提前发出的回复
+    prescorer_enabled: bool = False  # 先用本地词典评分，置信度够高时跳过远程的分析请求
+    prescorer_threshold: float = 0.75  # 本地评分的置信度不低于该值时直接采用
+    emotion_smoothing_enabled: bool = False  # 回复前对情绪权重做指数平滑，让机器人的情绪跨轮次更稳定
+    emotion_smoothing_alpha: float = 0.5  # 平滑时本轮分析结果所占的权重，越小情绪变化越慢
+    emotion_decay_half_life: float = 0.0  # 两轮之间情绪向 0 衰减的半衰期（秒），0 表示不衰减
+    analysis_cache_enabled: bool = True  # 相同的分析请求直接复用之前的结果
+    analysis_cache_size: int = 512   # 内存中最多缓存的分析结果条数
+    analysis_cache_ttl: float = 3600.0  # 分析结果的有效期（秒），0 表示不过期
+    analysis_cache_dir: str = ""     # 磁盘缓存目录，留空则只缓存在内存中
+    store_path: str = "heartchat.db"  # 对话记录的 SQLite 文件，留空则不保存
+    transcript_window_turns: int = 200  # 聊天框最多同时显示的消息条数
+    transcript_page_turns: int = 50  # 滚动到顶部时一次加载的更早消息条数
+    worker_threads: int = 2          # 执行对话的工作线程数
+    cancel_superseded: bool = True   # 新消息到来时取消还没完成的旧请求，并把旧消息并入新的一轮
+    server_host: str = "127.0.0.1"   # 服务模式监听的地址
+    server_port: int = 8765          # 服务模式监听的端口
+    server_max_upstream: int = 8     # 服务模式下同时进行的对话轮数上限，即并发的上游请求数
+    server_max_sessions: int = 1000  # 服务模式下同时保留在内存中的会话数上限
+    server_session_idle_timeout: float = 1800.0  # 会话空闲多久后从内存中移除（秒）
+    server_ws_max_pending: int = 4   # 每个 WebSocket 连接同时未完成的轮数上限，超出的消息直接返回错误
+    stream_usage_enabled: bool = False  # 流式请求附带 stream_options.include_usage，以便统计 token 用量
+    metrics_jsonl_path: str = ""     # 每轮的耗时和 token 用量追加写入的 JSONL 文件，留空则不写
+    analysis_endpoints: List[EndpointConfig] = []  # 分析阶段可用的端点，留空则使用 api_url / api_key / model
+    reply_endpoints: List[EndpointConfig] = []     # 回复阶段可用的端点，留空则使用 api_url / api_key / model
+    route_failure_threshold: int = 2  # 端点连续失败多少次后进入冷却
+    route_failure_cooldown: float = 30.0  # 冷却时长（秒），期间只有其他端点都失败时才会用到它
+    route_latency_alpha: float = 0.3  # 端点延迟指数移动平均的平滑系数
+    route_explore_rate: float = 0.05  # 偶尔先试一个不是最快的端点，以便更新它的延迟
+    pool_size: int = 4               # 每个端点的连接池大小
+    connect_timeout: float = 5.0     # 建立连接的超时（秒）
+    read_timeout: float = 60.0       # 等待响应的超时（秒）
+    max_retries: int = 2             # 遇到连接失败、429、5xx 时的最大重试次数
+    retry_backoff: float = 0.5       # 重试退避系数（秒）
+
+    def save_to_file(self, file_path="config.json"):
+        with open(file_path, "w", encoding="utf-8") as f:
+            json.dump(self.dict(), f, indent=4)
+
+    @classmethod
+    def load_from_file(cls, file_path="config.json"):
+        if not os.path.exists(file_path):
+            return cls()
+        try:
+            with open(file_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            return cls(**data)
+        except json.JSONDecodeError:
+            return cls()
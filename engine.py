@@ -0,0 +1,617 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+from cache import AnalysisCache, make_cache_key
+from history import ConversationHistory
+from metrics import Metrics
+from prescorer import EmotionPrescorer
+from prompts import PromptStore
+from protocol import EMOTION_NAMES, REPLY_MARKER, AnalysisResult, emotion_distance, parse_analysis, split_fused
+from routing import ANALYSIS, REPLY, Router
+from trajectory import EmotionTimeline
+from transport import HttpTransport, iter_sse_content
+
+DEFAULT_ANALYSIS_PROMPT = "{robot_name}，你是一个情绪分析机器人，请分析用户的情绪。"
+DEFAULT_REPLY_PROMPT = "{robot_name}，你是一个回复机器人，请友好地回复用户。"
+
+
+class PipelineError(Exception):
+    """流水线某个阶段（analysis / reply）失败"""
+
+    def __init__(self, stage, message):
+        super().__init__(message)
+        self.stage = stage
+
+
+class TurnCancelled(PipelineError):
+    """请求在完成前被取消（推测执行被放弃，或者被更新的消息取代）"""
+
+    def __init__(self, stage="reply"):
+        super().__init__(stage, "已取消")
+
+
+def check_cancelled(cancel, stage):
+    if cancel is not None and cancel.is_set():
+        raise TurnCancelled(stage)
+
+
+class _SpeculativeBuffer:
+    """推测执行的回复在被采纳前先缓存，被采纳后补发缓存内容并改为直接转发"""
+
+    def __init__(self):
+        self.parts = []
+        self.target = None
+        self.delivered = False  # 是否已经有片段转发给调用方
+        self.lock = threading.Lock()
+
+    def feed(self, delta):
+        with self.lock:
+            if self.target is None:
+                self.parts.append(delta)
+                return
+            target = self.target
+            self.delivered = True
+        target(delta)
+
+    def accept(self, on_delta):
+        # 在锁内补发，保证之后到达的片段排在缓存内容后面
+        with self.lock:
+            self.target = on_delta or (lambda delta: None)
+            for delta in self.parts:
+                self.target(delta)
+            self.delivered = bool(self.parts)
+            self.parts = []
+
+
+class Session:
+    """单个对话的状态，不依赖任何界面控件"""
+
+    def __init__(self, config, conversation_id=None):
+        self.conversation_id = conversation_id  # 写入对话记录时使用的对话 id
+        self.last_robot_reply = None  # 存储机器人的回复内容
+        self.last_analysis = None     # 上一轮的分析结果
+        self.timeline = EmotionTimeline()  # 每轮的原始和平滑后的情绪权重
+        self.history = ConversationHistory(config.context_token_budget, config.context_max_turns)
+        self.summary_backlog = []     # 移出窗口、还没有并入摘要的旧对话
+        self.summary_running = False  # 是否有后台任务正在更新摘要
+        self.summary_lock = threading.Lock()
+
+
+class TurnResult:
+    """一轮对话的结果"""
+
+    def __init__(self, user_message, analysis, reply, speculation=None, turn_id=None, mood=None, source=None,
+                 reply_id=None):
+        self.turn_id = turn_id  # 写入对话记录后用户消息的 id
+        self.reply_id = reply_id  # 写入对话记录后机器人回复的 id
+        self.user_message = user_message
+        self.analysis = analysis  # protocol.AnalysisResult
+        self.mood = mood or analysis  # 平滑后实际用于回复的 AnalysisResult，未开启平滑时就是 analysis
+        self.reply = reply
+        self.speculation = speculation  # 推测执行的结果："accepted" / "rejected"，未启用时为 None
+        self.source = source  # 分析结果的来源："remote" / "prescorer" / "fused"
+
+    def to_dict(self):
+        data = {"user": self.user_message}
+        data.update(self.analysis.to_dict())
+        if self.mood is not self.analysis:
+            data["mood"] = self.mood.emotions()
+        data["reply"] = self.reply
+        if self.speculation is not None:
+            data["speculation"] = self.speculation
+        if self.source is not None:
+            data["source"] = self.source
+        return data
+
+
+def extract_robot_reply(response):
+    """提取机器人的回复内容"""
+    return response.strip()
+
+
+class PipelineEngine:
+    """情绪分析 -> 回复 的核心流水线，与 tkinter 界面解耦"""
+
+    def __init__(self, config, transport=None, prompt_store=None, store=None, metrics=None):
+        self.config = config
+        self.metrics = metrics or Metrics(config.metrics_jsonl_path)
+        self.store = store  # 可选的 store.ConversationStore，用于持久化每一轮对话
+        self.prompt_store = prompt_store or PromptStore()
+        self.transport = transport or HttpTransport(config)
+        self.router = Router(config, self.transport, self.metrics)  # 分析和回复各自选择端点
+        self._speculative_pool = None
+        self._summary_pool = None
+        self._prescorer = None
+        self.analysis_cache = AnalysisCache(
+            config.analysis_cache_size, config.analysis_cache_ttl, config.analysis_cache_dir
+        )
+
+    def read_prompt_file(self, prompt_file, default):
+        """读取提示词文件，返回 (内容, 文件是否缺失)"""
+        default = default.format(robot_name=self.config.robot_name)
+        if prompt_file == "无":
+            return default, False
+        try:
+            return self.prompt_store.read(prompt_file), False
+        except FileNotFoundError:
+            return default, True
+
+    def load_prompts(self, analysis_prompt_file=None, reply_prompt_file=None):
+        """读取两个机器人的提示词，返回 (分析提示词, 回复提示词, 缺失的文件列表)"""
+        if analysis_prompt_file is None:
+            analysis_prompt_file = self.config.analysis_prompt_file
+        if reply_prompt_file is None:
+            reply_prompt_file = self.config.reply_prompt_file
+        missing = []
+        analysis_prompt_content, analysis_missing = self.read_prompt_file(analysis_prompt_file, DEFAULT_ANALYSIS_PROMPT)
+        if analysis_missing:
+            missing.append(analysis_prompt_file)
+        reply_prompt_content, reply_missing = self.read_prompt_file(reply_prompt_file, DEFAULT_REPLY_PROMPT)
+        if reply_missing:
+            missing.append(reply_prompt_file)
+        return analysis_prompt_content, reply_prompt_content, missing
+
+    def build_analysis_system_prompt(self, analysis_prompt_content):
+        """构建 Robot1（分析机器人）的系统提示词，相同输入复用同一个字符串"""
+        return self.prompt_store.compile(
+            ("analysis", self.config.robot_name, analysis_prompt_content),
+            lambda: (
+                f"你是一个名为{self.config.robot_name}的情绪分析机器人，你的任务是根据用户消息，决定机器人应该表现出的情绪，并生成提示词来控制机器人的行为。\n"
+                "你需要返回模型参数（temperature 和 topp）、机器人应该表现的情绪权重，以及提示词。\n"
+                "temperature 的范围是 0.0 到 2.0，topp 的范围是 0.0 到 1.0。\n"
+                "请严格按照以下格式返回内容，否则你的输出将被忽略，不会显示在界面或发送给机器人：\n"
+                "~!modelparam:{temperature:[<value>],topp:[<value>]}!~\n"
+                "~!emoweight:{happiness:[<value>];anger:[<value>];fear:[<value>];sadness:[<value>];disgust:[<value>];surprise:[<value>]}!~\n"
+                "~!prompt:[<提示词内容>]!~\n"
+                "例如：\n"
+                "~!modelparam:{temperature:[0.7],topp:[0.9]}!~\n"
+                "~!emoweight:{happiness:[0.5];anger:[0.1];fear:[0.2];sadness:[0.1];disgust:[0.0];surprise:[0.1]}!~\n"
+                f"~!prompt:[{analysis_prompt_content}]!~\n"
+                "请严格遵循上述格式返回内容，不要返回其他任何多余的内容！\n"
+            )
+        )
+
+    def build_analysis_user_message(self, session, user_message):
+        """如果有上次机器人的回复，一起发送给 Robot1"""
+        if session.last_robot_reply:
+            return f"用户消息: {user_message}\n上次机器人回复: {session.last_robot_reply}\n用户名: {self.config.user_name}"
+        return f"用户消息: {user_message}\n用户名: {self.config.user_name}"
+
+    def build_reply_system_prompt(self, reply_prompt_content):
+        """构建回复机器人的系统提示词，只包含不随轮次变化的内容，相同输入复用同一个字符串"""
+        return self.prompt_store.compile(
+            ("reply", self.config.robot_name, self.config.user_name, reply_prompt_content),
+            lambda: (
+                f"你是一个名为{self.config.robot_name}的机器人，用户名是 {self.config.user_name}，根据以下提示词和情绪权重调整语气：\n"
+                f"提示词：\n{reply_prompt_content}\n"
+                "请根据这些信息调整回复语气。\n"
+            )
+        )
+
+    def build_emotion_prompt(self, analysis):
+        """这一轮的情绪权重，作为单独的系统消息发送"""
+        emotion_prompt = "\n".join([f"- {k}: {v}" for k, v in analysis.emotions().items()])
+        return f"情绪权重：\n{emotion_prompt}\n"
+
+    def build_reply_messages(self, session, user_message, analysis, reply_prompt_content):
+        """构建回复机器人的 messages；开启上下文时把历史对话作为独立的消息发送
+
+        静态的系统提示词和历史对话在前，每轮变化的情绪权重放在最后一条用户消息之前，
+        这样整段历史都是稳定的前缀，服务端的前缀缓存（prompt caching）可以命中。
+        """
+        messages = [{"role": "system", "content": self.build_reply_system_prompt(reply_prompt_content)}]
+        if self.config.context_enabled:
+            messages.extend(session.history.to_messages())
+        messages.append({"role": "system", "content": self.build_emotion_prompt(analysis)})
+        messages.append({"role": "user", "content": user_message})
+        return messages
+
+    def restore_session(self, session):
+        """从对话记录恢复会话的历史、上次回复和上次分析结果"""
+        if self.store is None or session.conversation_id is None:
+            return
+        for turn in self.store.load_before(session.conversation_id, None, self.config.context_max_turns):
+            session.history.append(turn.role, turn.content)
+            if turn.role == "assistant":
+                session.last_robot_reply = turn.content
+                if turn.analysis is not None:
+                    session.last_analysis = turn.analysis
+                    session.timeline.observe(turn.analysis.emotion_vector(), self.smoothing_alpha(),
+                                             self.config.emotion_decay_half_life, turn.created)
+        session.history.trim()
+
+    def smoothing_alpha(self):
+        return self.config.emotion_smoothing_alpha if self.config.emotion_smoothing_enabled else 1.0
+
+    def smooth(self, session, analysis, now):
+        """把本轮的情绪权重和之前的情绪轨迹平滑合并，返回用于回复的 AnalysisResult；未开启平滑时原样返回"""
+        if not self.config.emotion_smoothing_enabled:
+            return analysis
+        vector = session.timeline.preview(
+            analysis.emotion_vector(), self.config.emotion_smoothing_alpha, self.config.emotion_decay_half_life, now
+        )
+        return AnalysisResult(analysis.temperature, analysis.top_p, dict(zip(EMOTION_NAMES, vector)), analysis.prompt)
+
+    def summarize(self, previous_summary, turns):
+        """把移出窗口的旧对话和之前的摘要合并成新的摘要，失败时返回 None"""
+        names = {"user": self.config.user_name, "assistant": self.config.robot_name}
+        dialogue = "\n".join(f"{names.get(turn['role'], turn['role'])}: {turn['content']}" for turn in turns)
+        content = f"之前的摘要：\n{previous_summary}\n\n新的对话：\n{dialogue}" if previous_summary else dialogue
+        messages = [
+            {"role": "system", "content": "请把下面的对话压缩成简短的摘要，保留人物、事实和情绪变化，只返回摘要本身。"},
+            {"role": "user", "content": content}
+        ]
+        try:
+            with self.metrics.time("summary"):
+                # 摘要是简单的文本压缩，交给分析阶段的端点
+                response = self.router.post(ANALYSIS, {"messages": messages, "temperature": 0.3})
+                if response.status_code != 200:
+                    return None
+                data = response.json()
+            self.metrics.record_usage("summary", data.get("usage"))
+            return data.get("choices", [{}])[0].get("message", {}).get("content", "").strip() or None
+        except Exception:
+            return None
+
+    def compact_history(self, session):
+        """裁剪历史对话；开启摘要时在后台把被裁掉的部分并入滚动摘要，不拖慢这一轮的返回"""
+        history = session.history
+        history.token_budget = self.config.context_token_budget
+        history.max_turns = self.config.context_max_turns
+        dropped = history.trim()
+        if not (dropped and self.config.context_enabled and self.config.context_summary_enabled):
+            return
+        with session.summary_lock:
+            session.summary_backlog.extend(dropped)
+            if session.summary_running:
+                # 正在运行的任务会接着处理新加入的部分
+                return
+            session.summary_running = True
+        if self._summary_pool is None:
+            self._summary_pool = ThreadPoolExecutor(max_workers=self.config.pool_size, thread_name_prefix="summary")
+        self._summary_pool.submit(self._summarize_backlog, session)
+
+    def _summarize_backlog(self, session):
+        """后台任务：把积累的旧对话依次并入摘要，同一会话同时只有一个任务在运行"""
+        while True:
+            with session.summary_lock:
+                turns = session.summary_backlog
+                session.summary_backlog = []
+                if not turns:
+                    session.summary_running = False
+                    return
+            summary = self.summarize(session.history.summary, turns)
+            if summary:
+                session.history.summary = summary
+
+    def format_robot_line(self, robot_reply):
+        """生成聊天记录里机器人的一行，修复重复名称问题"""
+        if robot_reply.startswith(f"{self.config.robot_name}:"):
+            return robot_reply
+        return f"{self.config.robot_name}: {robot_reply}"
+
+    def analyze(self, system_prompt, user_message):
+        """调用 Robot1（情绪分析机器人），返回 AnalysisResult"""
+        messages = [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_message}
+        ]
+        payload = {"messages": messages}
+        cache_key = None
+        if self.config.analysis_cache_enabled:
+            cache_key = make_cache_key(self.router.signature(ANALYSIS), payload)
+            cached = self.analysis_cache.get(cache_key)
+            if cached is not None:
+                with self.metrics.time("parse"):
+                    analysis = parse_analysis(cached)
+                if analysis is not None:
+                    return analysis
+        try:
+            with self.metrics.time("analysis"):
+                response = self.router.post(ANALYSIS, payload)
+                if response.status_code != 200:
+                    raise PipelineError("analysis", f"Robot1 请求失败: {response.text}")
+                data = response.json()
+            self.metrics.record_usage("analysis", data.get("usage"))
+            robot1_response = data.get("choices", [{}])[0].get("message", {}).get("content", "")
+        except PipelineError:
+            raise
+        except Exception as e:
+            raise PipelineError("analysis", f"Robot1 请求失败: {str(e)}") from e
+        with self.metrics.time("parse"):
+            analysis = parse_analysis(robot1_response)
+        if analysis is None:
+            raise PipelineError("analysis", "Robot1 返回的内容格式不正确，请检查 Robot1 的输出是否符合指定格式！")
+        # 只缓存格式正确的结果
+        if cache_key is not None:
+            self.analysis_cache.put(cache_key, robot1_response)
+        return analysis
+
+    def prescore(self, user_message):
+        """用本地评分器估计情绪，置信度达到阈值时返回 AnalysisResult，否则返回 None"""
+        if self._prescorer is None:
+            self._prescorer = EmotionPrescorer()
+        with self.metrics.time("prescore"):
+            analysis, confidence = self._prescorer.score(user_message)
+        if confidence < self.config.prescorer_threshold:
+            self.metrics.increment("prescorer_miss")
+            return None
+        self.metrics.increment("prescorer_hit")
+        return analysis
+
+    def complete(self, payload, on_delta=None, cancel=None, stage="reply"):
+        """发送一次回复类请求并返回完整的文本；流式模式下每收到一段文本就调用 on_delta
+
+        cancel 是一个 threading.Event，流式模式下每收到一段文本检查一次，被设置后立即断开连接。
+        stage 是记录耗时和 token 用量时使用的阶段名。
+        """
+        with self.metrics.time(stage):
+            return self._complete(payload, on_delta, cancel, stage)
+
+    def _complete(self, payload, on_delta, cancel, stage):
+        try:
+            if self.config.stream_enabled:
+                payload["stream"] = True
+                if self.config.stream_usage_enabled:
+                    payload["stream_options"] = {"include_usage": True}
+            response = self.router.post(REPLY, payload, stream=self.config.stream_enabled)
+            if response.status_code != 200:
+                raise PipelineError("reply", f"错误: {response.text}")
+            if not self.config.stream_enabled:
+                data = response.json()
+                self.metrics.record_usage(stage, data.get("usage"))
+                return data.get("choices", [{}])[0].get("message", {}).get("content", "")
+            parts = []
+            try:
+                for delta in iter_sse_content(response, lambda usage: self.metrics.record_usage(stage, usage)):
+                    if cancel is not None and cancel.is_set():
+                        raise TurnCancelled()
+                    parts.append(delta)
+                    if on_delta is not None:
+                        on_delta(delta)
+            finally:
+                response.close()
+            if cancel is not None and cancel.is_set():
+                raise TurnCancelled()
+            return "".join(parts)
+        except PipelineError:
+            raise
+        except Exception as e:
+            raise PipelineError("reply", f"请求失败: {str(e)}") from e
+
+    def reply(self, session, user_message, analysis, reply_prompt_content, on_delta=None, cancel=None):
+        """调用回复机器人，返回回复内容"""
+        payload = {
+            "messages": self.build_reply_messages(session, user_message, analysis, reply_prompt_content),
+            "temperature": analysis.temperature,
+            "top_p": analysis.top_p
+        }
+        return extract_robot_reply(self.complete(payload, on_delta, cancel))
+
+    def run_speculative(self, session, user_message, analysis_prompt_content, reply_prompt_content,
+                        on_analysis=None, on_delta=None, cancel=None, reply_message=None):
+        """推测执行：用上一轮的分析结果提前发出回复请求，与本轮分析并行
+
+        本轮分析出来后，情绪权重的变化不超过阈值就采纳提前发出的回复，否则取消并重新请求。
+        开启平滑时比较的是平滑后的情绪权重。user_message 发给 Robot1，reply_message 发给回复机器人，
+        不指定时两者相同。采纳后的请求失败时，如果还没有输出任何片段就重新请求，否则直接抛出错误。
+        返回 (AnalysisResult, 用于回复的 AnalysisResult, 回复内容, "accepted" / "rejected")。
+        """
+        if self._speculative_pool is None:
+            self._speculative_pool = ThreadPoolExecutor(max_workers=self.config.pool_size, thread_name_prefix="speculative")
+        now = time.time()
+        previous = self.smooth(session, session.last_analysis, now)
+        buffer = _SpeculativeBuffer()
+        speculative_cancel = threading.Event()
+        if reply_message is None:
+            reply_message = user_message
+        future = self._speculative_pool.submit(
+            self._speculative_reply, session, reply_message, previous, reply_prompt_content, buffer.feed, speculative_cancel
+        )
+        try:
+            analysis = self.analyze(self.build_analysis_system_prompt(analysis_prompt_content), user_message)
+            check_cancelled(cancel, "analysis")
+        except PipelineError:
+            speculative_cancel.set()
+            raise
+        if on_analysis is not None:
+            on_analysis(analysis)
+        mood = self.smooth(session, analysis, now)
+        if emotion_distance(previous, mood) <= self.config.speculative_threshold:
+            buffer.accept(on_delta)
+            try:
+                robot_reply, record = self._wait_speculative(future, cancel, speculative_cancel)
+                self.metrics.merge(record)
+                return analysis, previous, robot_reply, "accepted"
+            except TurnCancelled:
+                raise
+            except PipelineError:
+                # 部分回复已经显示给调用方，重新请求会让文本重复，直接报错
+                if buffer.delivered:
+                    raise
+                # 还没有输出任何内容，按正常流程重新请求
+        else:
+            # 非流式模式下无法中断已经发出的请求，只能丢弃它的结果
+            speculative_cancel.set()
+        robot_reply = self.reply(session, reply_message, mood, reply_prompt_content, on_delta=on_delta, cancel=cancel)
+        return analysis, mood, robot_reply, "rejected"
+
+    def _speculative_reply(self, session, user_message, analysis, reply_prompt_content, on_delta, cancel):
+        """在推测线程中请求回复，返回 (回复内容, 这次请求的计时和用量)，采纳后并入这一轮的记录"""
+        with self.metrics.collect() as record:
+            robot_reply = self.reply(session, user_message, analysis, reply_prompt_content, on_delta, cancel)
+        return robot_reply, record
+
+    def _wait_speculative(self, future, cancel, speculative_cancel):
+        """等待已采纳的推测请求完成；整轮被取消时同时中断它"""
+        while True:
+            try:
+                return future.result(timeout=0.05)
+            except FutureTimeoutError:
+                if cancel is not None and cancel.is_set():
+                    speculative_cancel.set()
+
+    def build_fused_system_prompt(self, analysis_prompt_content, reply_prompt_content):
+        """构建合并模式的系统提示词：先输出分析区块，再输出回复"""
+        return self.prompt_store.compile(
+            ("fused", self.config.robot_name, self.config.user_name, analysis_prompt_content, reply_prompt_content),
+            lambda: (
+                f"你是一个名为{self.config.robot_name}的机器人，用户名是 {self.config.user_name}。你的每次输出分为两部分。\n"
+                "第一部分：根据用户消息，决定你这次应该表现出的情绪，返回模型参数（temperature 和 topp）、情绪权重，以及提示词。\n"
+                "temperature 的范围是 0.0 到 2.0，topp 的范围是 0.0 到 1.0。\n"
+                "请严格按照以下格式返回第一部分：\n"
+                "~!modelparam:{temperature:[<value>],topp:[<value>]}!~\n"
+                "~!emoweight:{happiness:[<value>];anger:[<value>];fear:[<value>];sadness:[<value>];disgust:[<value>];surprise:[<value>]}!~\n"
+                "~!prompt:[<提示词内容>]!~\n"
+                "例如：\n"
+                "~!modelparam:{temperature:[0.7],topp:[0.9]}!~\n"
+                "~!emoweight:{happiness:[0.5];anger:[0.1];fear:[0.2];sadness:[0.1];disgust:[0.0];surprise:[0.1]}!~\n"
+                f"~!prompt:[{analysis_prompt_content}]!~\n"
+                f"第二部分：另起一行输出 {REPLY_MARKER}，然后按照第一部分的情绪权重和提示词调整语气，以{self.config.robot_name}的身份回复用户。\n"
+                f"回复时遵循的提示词：\n{reply_prompt_content}\n"
+                "除了这两部分，不要返回其他任何多余的内容！\n"
+            )
+        )
+
+    def fused_sampling_params(self, session):
+        """合并模式下分析结果要等输出后才知道，采样参数取上一轮的分析结果或配置中的默认值"""
+        if self.config.fused_use_previous_params and session.last_analysis is not None:
+            return session.last_analysis.temperature, session.last_analysis.top_p
+        return self.config.fused_temperature, self.config.fused_top_p
+
+    def run_fused(self, session, user_message, analysis_prompt_content, reply_prompt_content,
+                  on_analysis=None, on_delta=None, cancel=None):
+        """合并模式：一次请求同时得到分析区块和回复，返回 (AnalysisResult, 回复内容)"""
+        messages = [{"role": "system", "content": self.build_fused_system_prompt(analysis_prompt_content, reply_prompt_content)}]
+        if self.config.context_enabled:
+            messages.extend(session.history.to_messages())
+        messages.append({"role": "user", "content": user_message})
+        temperature, top_p = self.fused_sampling_params(session)
+        payload = {"messages": messages, "temperature": temperature, "top_p": top_p}
+
+        # 流式输出时先缓存分析区块，看到回复标记后更新分析窗口，之后的文本才转发给 on_delta
+        received = []
+        state = {"analysis": None, "replying": False}
+
+        def split_delta(delta):
+            if state["replying"]:
+                if on_delta is not None:
+                    on_delta(delta)
+                return
+            received.append(delta)
+            head, reply_text = split_fused("".join(received))
+            if reply_text is None:
+                return
+            state["replying"] = True
+            state["analysis"] = parse_analysis(head)
+            if state["analysis"] is not None and on_analysis is not None:
+                on_analysis(state["analysis"])
+            reply_text = reply_text.lstrip()
+            if reply_text and on_delta is not None:
+                on_delta(reply_text)
+
+        text = self.complete(payload, split_delta, cancel, stage="fused")
+        head, reply_text = split_fused(text)
+        if reply_text is None:
+            # 模型漏掉了回复标记时，把最后一个区块之后的内容当作回复
+            reply_text = text.rsplit("!~", 1)[-1]
+        analysis = state["analysis"] or parse_analysis(head)
+        if analysis is None:
+            raise PipelineError("analysis", "Robot1 返回的内容格式不正确，请检查 Robot1 的输出是否符合指定格式！")
+        if not state["replying"] and on_analysis is not None:
+            on_analysis(analysis)
+        return analysis, extract_robot_reply(reply_text)
+
+    def run_turn(self, session, user_message, analysis_prompt_content=None, reply_prompt_content=None,
+                 on_analysis=None, on_delta=None, cancel=None):
+        """同步执行一轮完整的 分析 -> 回复，返回 TurnResult
+
+        cancel 是一个 threading.Event，在各阶段之间和流式输出过程中检查，被设置后抛出 TurnCancelled，
+        被取消的一轮不会写入对话历史。
+        """
+        self.metrics.begin_turn()
+        try:
+            with self.metrics.time("turn"):
+                result = self._run_turn(session, user_message, analysis_prompt_content, reply_prompt_content,
+                                        on_analysis, on_delta, cancel)
+        except TurnCancelled:
+            self.metrics.increment("turn_cancelled")
+            self.metrics.end_turn(conversation_id=session.conversation_id, status="cancelled")
+            raise
+        except PipelineError as e:
+            self.metrics.increment(f"{e.stage}_error")
+            self.metrics.end_turn(conversation_id=session.conversation_id, status="error", stage=e.stage)
+            raise
+        if result.speculation is not None:
+            self.metrics.increment(f"speculation_{result.speculation}")
+        self.metrics.end_turn(conversation_id=session.conversation_id, status="ok", speculation=result.speculation)
+        return result
+
+    def _run_turn(self, session, user_message, analysis_prompt_content, reply_prompt_content,
+                  on_analysis, on_delta, cancel):
+        check_cancelled(cancel, "analysis")
+        with self.metrics.time("prompt"):
+            if analysis_prompt_content is None or reply_prompt_content is None:
+                loaded_analysis, loaded_reply, _ = self.load_prompts()
+                if analysis_prompt_content is None:
+                    analysis_prompt_content = loaded_analysis
+                if reply_prompt_content is None:
+                    reply_prompt_content = loaded_reply
+            user_message_with_reply = self.build_analysis_user_message(session, user_message)
+            # 开启上下文时上一轮回复已经作为历史消息发送，回复阶段只需要这一轮的原始消息
+            reply_message = user_message if self.config.context_enabled else user_message_with_reply
+            robot1_system_prompt = self.build_analysis_system_prompt(analysis_prompt_content)
+        speculation = None
+        analysis = None
+        source = "remote"
+        now = time.time()
+        if self.config.prescorer_enabled and not self.config.fused_enabled:
+            # 本地评分只看这一轮用户说的话，不含上一轮的回复
+            analysis = self.prescore(user_message)
+            if analysis is not None:
+                source = "prescorer"
+        if self.config.fused_enabled:
+            source = "fused"
+            analysis, robot_reply = self.run_fused(
+                session, reply_message, analysis_prompt_content, reply_prompt_content,
+                on_analysis=on_analysis, on_delta=on_delta, cancel=cancel
+            )
+            # 合并模式的回复和分析同时生成，平滑结果只记入情绪轨迹
+            mood = self.smooth(session, analysis, now)
+        elif analysis is None and self.config.speculative_enabled and session.last_analysis is not None:
+            analysis, mood, robot_reply, speculation = self.run_speculative(
+                session, user_message_with_reply, analysis_prompt_content, reply_prompt_content,
+                on_analysis=on_analysis, on_delta=on_delta, cancel=cancel, reply_message=reply_message
+            )
+        else:
+            if analysis is None:
+                analysis = self.analyze(robot1_system_prompt, user_message_with_reply)
+            check_cancelled(cancel, "analysis")
+            if on_analysis is not None:
+                on_analysis(analysis)
+            mood = self.smooth(session, analysis, now)
+            robot_reply = self.reply(session, reply_message, mood, reply_prompt_content,
+                                     on_delta=on_delta, cancel=cancel)
+        session.history.append("user", user_message)
+        session.history.append("assistant", robot_reply)
+        self.compact_history(session)
+        session.last_robot_reply = robot_reply
+        session.last_analysis = analysis
+        session.timeline.append(analysis.emotion_vector(), mood.emotion_vector(), now)
+        turn_id = reply_id = None
+        if self.store is not None and session.conversation_id is not None:
+            turn_id = self.store.append(session.conversation_id, "user", self.config.user_name, user_message)
+            reply_id = self.store.append(
+                session.conversation_id, "assistant", self.config.robot_name, robot_reply, analysis, source
+            )
+        return TurnResult(user_message, analysis, robot_reply, speculation, turn_id, mood, source, reply_id)
+
+    async def arun_turn(self, session, user_message, analysis_prompt_content=None, reply_prompt_content=None,
+                        on_analysis=None, on_delta=None, cancel=None):
+        """run_turn 的异步版本，阻塞的网络请求放到线程池中执行"""
+        return await asyncio.to_thread(
+            self.run_turn, session, user_message, analysis_prompt_content, reply_prompt_content,
+            on_analysis, on_delta, cancel
+        )
@@ -0,0 +1,126 @@
+"""评估本地情绪预评分：和记录下来的 Robot1 分析结果逐条比较
+
+数据来源可以是对话记录（SQLite），也可以是 batch_runner.py 输出的 JSONL 文件。
+输出各情绪的平均绝对误差、主导情绪一致率，以及不同置信度阈值下能跳过多少远程分析请求。
+需要安装 NumPy。
+"""
+import argparse
+import json
+import sys
+
+from config import Config
+from prescorer import EmotionPrescorer, np
+from protocol import EMOTION_NAMES
+from store import ConversationStore
+
+DEFAULT_THRESHOLDS = (0.3, 0.4, 0.5, 0.6, 0.7, 0.75, 0.8, 0.9)
+# 本地评分生成的结果也会写入对话记录，按来源跳过，避免拿评分器和自己比较
+PRESCORER_SOURCE = "prescorer"
+
+
+def load_from_store(path, limit=None):
+    store = ConversationStore(path)
+    try:
+        samples = [
+            (user_message, analysis.emotion_vector())
+            for user_message, analysis in store.load_analyzed(limit, exclude_sources=(PRESCORER_SOURCE,))
+        ]
+    finally:
+        store.close()
+    return samples
+
+
+def load_from_jsonl(path, limit=None):
+    """读取 batch_runner.py 的输出"""
+    samples = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            for turn in json.loads(line).get("turns", []):
+                if "emotions" not in turn or turn.get("source") == PRESCORER_SOURCE:
+                    continue
+                samples.append((turn["user"], tuple(turn["emotions"].get(name, 0.0) for name in EMOTION_NAMES)))
+    return samples[-limit:] if limit else samples
+
+
+def evaluate(scorer, samples, thresholds=DEFAULT_THRESHOLDS):
+    messages = [message for message, _ in samples]
+    predicted, confidence = scorer.score_batch(messages)
+    predicted = np.array(predicted)
+    confidence = np.array(confidence)
+    expected = np.array([vector for _, vector in samples], dtype=float)
+
+    errors = np.abs(predicted - expected)
+    # 两边都没有明显情绪时，主导情绪没有意义，不计入一致率
+    emotional = (expected.max(axis=1) > 0.2) | (predicted.max(axis=1) > 0.2)
+    # 本地评分没有给出任何情绪时算作不一致
+    agree = (predicted.argmax(axis=1) == expected.argmax(axis=1)) & (predicted.max(axis=1) > 0)
+    norms = np.linalg.norm(predicted, axis=1) * np.linalg.norm(expected, axis=1)
+    cosine = np.divide((predicted * expected).sum(axis=1), norms, out=np.zeros(len(samples)), where=norms > 0)
+
+    sweep = []
+    for threshold in thresholds:
+        selected = confidence >= threshold
+        count = int(selected.sum())
+        sweep.append({
+            "threshold": threshold,
+            "coverage": count / len(samples),
+            "mae": float(errors[selected].mean()) if count else None,
+            "agreement": float(agree[selected & emotional].mean()) if (selected & emotional).any() else None,
+        })
+    return {
+        "samples": len(samples),
+        "mae": float(errors.mean()),
+        "mae_by_emotion": dict(zip(EMOTION_NAMES, errors.mean(axis=0).tolist())),
+        "agreement": float(agree[emotional].mean()) if emotional.any() else None,
+        "cosine": float(cosine.mean()),
+        "mean_confidence": float(confidence.mean()),
+        "thresholds": sweep,
+    }
+
+
+def _format(value, pattern):
+    return "-" if value is None else format(value, pattern)
+
+
+def print_report(report):
+    print(f"样本数 {report['samples']}，平均绝对误差 {report['mae']:.3f}，"
+          f"主导情绪一致率 {_format(report['agreement'], '.1%')}，余弦相似度 {report['cosine']:.3f}，"
+          f"平均置信度 {report['mean_confidence']:.3f}")
+    print("各情绪的平均绝对误差：")
+    for name, value in report["mae_by_emotion"].items():
+        print(f"  {name:<10}{value:.3f}")
+    print(f"{'阈值':<8}{'跳过比例':>10}{'误差':>10}{'一致率':>10}")
+    for row in report["thresholds"]:
+        print(f"{row['threshold']:<10}{row['coverage']:>12.1%}{_format(row['mae'], '.3f'):>12}"
+              f"{_format(row['agreement'], '.1%'):>11}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="把本地情绪预评分和记录下来的 Robot1 分析结果进行比较")
+    parser.add_argument("--jsonl", help="batch_runner.py 输出的 JSONL 文件，不指定时读取对话记录")
+    parser.add_argument("--db", help="对话记录的 SQLite 文件，默认使用配置中的 store_path")
+    parser.add_argument("--config", default="config.json", help="配置文件路径")
+    parser.add_argument("--limit", type=int, help="只使用最近的 N 条记录")
+    parser.add_argument("--json", help="把结果另存为 JSON 文件")
+    args = parser.parse_args()
+
+    if np is None:
+        sys.exit("评估需要安装 NumPy")
+    if args.jsonl:
+        samples = load_from_jsonl(args.jsonl, args.limit)
+    else:
+        samples = load_from_store(args.db or Config.load_from_file(args.config).store_path, args.limit)
+    if not samples:
+        sys.exit("没有可用于比较的分析记录")
+    report = evaluate(EmotionPrescorer(), samples)
+    print_report(report)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=4)
+
+
+if __name__ == "__main__":
+    main()
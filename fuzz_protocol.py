@@ -0,0 +1,165 @@
+"""Robot1 输出解析的回归语料和随机变异测试
+
+先逐条检查 parse_corpus.jsonl 中的样例是否得到预期结果，再对语料做随机变异（截断、插入杂字符、
+重复或删除区块、替换数值等），确认 parse_analysis 不抛异常，返回值要么是 None，要么是各字段都在
+合法区间内、并且能按协议格式原样还原的 AnalysisResult。最后报告每次解析的平均耗时。
+有失败时以非零状态退出。
+"""
+import argparse
+import json
+import math
+import random
+import sys
+import time
+
+from protocol import EMOTION_NAMES, AnalysisResult, parse_analysis
+
+DEFAULT_CORPUS = "parse_corpus.jsonl"
+# 变异时插入的片段：协议标记的碎片、全角符号、极端数值和控制字符
+FRAGMENTS = (
+    "~!", "!~", "[", "]", "{", "}", ":", ";", "：", "，", "【", "】", "\n", "\r\n", "\x00", " ",
+    "~!prompt:[", "~!emoweight:{", "~!modelparam:{", "~!reply!~", "1e999", "-0", "nan", "inf", ".", "😊",
+)
+NUMBERS = ("0", "1", "-1", "2.5", "1e999", "-1e999", "1e-9", ".5", "5.", "99999999999999999999", "0x10", "1_0")
+
+
+def load_corpus(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def check_invariants(text, result):
+    """返回违反的约束列表，为空表示通过"""
+    if result is None:
+        return []
+    if not isinstance(result, AnalysisResult):
+        return [f"返回了 {type(result).__name__}"]
+    problems = []
+    ranges = [("temperature", 0.0, 2.0), ("top_p", 0.0, 1.0)] + [(name, 0.0, 1.0) for name in EMOTION_NAMES]
+    for name, low, high in ranges:
+        value = getattr(result, name)
+        if not isinstance(value, float) or math.isnan(value) or not low <= value <= high:
+            problems.append(f"{name}={value!r} 不在 [{low}, {high}] 内")
+    if "[" in result.prompt or "]" in result.prompt:
+        problems.append("提示词中残留方括号")
+    # 提示词里带有协议标记时无法原样还原，只检查其余情况
+    if not problems and "~!" not in result.prompt and "!~" not in result.prompt:
+        again = parse_analysis(result.format())
+        if again is None or again.to_dict() != result.to_dict():
+            problems.append(f"format() 之后无法原样解析: {again!r}")
+    return problems
+
+
+def mutate(text, rng):
+    """对文本做 1 到 4 次随机变异"""
+    for _ in range(rng.randint(1, 4)):
+        kind = rng.randrange(6)
+        position = rng.randint(0, len(text))
+        if kind == 0:
+            text = text[:position]
+        elif kind == 1:
+            text = text[:position] + rng.choice(FRAGMENTS) + text[position:]
+        elif kind == 2 and text:
+            end = min(len(text), position + rng.randint(1, 8))
+            text = text[:position] + text[end:]
+        elif kind == 3:
+            start = text.find("~!", position)
+            end = text.find("!~", start + 2) if start >= 0 else -1
+            if end >= 0:
+                # 把一个区块再复制一份插到随机位置
+                block = text[start:end + 2]
+                target = rng.randint(0, len(text))
+                text = text[:target] + block + text[target:]
+        elif kind == 4:
+            start = text.find("[", position)
+            end = text.find("]", start + 1) if start >= 0 else -1
+            if end >= 0:
+                text = text[:start + 1] + rng.choice(NUMBERS) + text[end:]
+        else:
+            text = text[:position] + chr(rng.randrange(0x20, 0x3000)) + text[position:]
+    return text
+
+
+def check_corpus(corpus):
+    failures = []
+    for case in corpus:
+        try:
+            result = parse_analysis(case["input"])
+        except Exception as e:
+            failures.append((case["name"], f"抛出 {e!r}"))
+            continue
+        actual = result.to_dict() if result is not None else None
+        if actual != case["expected"]:
+            failures.append((case["name"], f"预期 {case['expected']!r}，实际 {actual!r}"))
+            continue
+        for problem in check_invariants(case["input"], result):
+            failures.append((case["name"], problem))
+    return failures
+
+
+def fuzz(corpus, iterations, seed):
+    rng = random.Random(seed)
+    inputs = [case["input"] for case in corpus]
+    failures = []
+    parsed = 0
+    for index in range(iterations):
+        text = mutate(rng.choice(inputs), rng)
+        try:
+            result = parse_analysis(text)
+        except Exception as e:
+            failures.append((f"#{index}", f"抛出 {e!r}", text))
+            continue
+        parsed += result is not None
+        for problem in check_invariants(text, result):
+            failures.append((f"#{index}", problem, text))
+    return failures, parsed
+
+
+def benchmark(corpus, repeat):
+    inputs = [case["input"] for case in corpus]
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for text in inputs:
+            parse_analysis(text)
+    return (time.perf_counter() - start) / (repeat * len(inputs))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="用回归语料和随机变异检查 Robot1 输出的解析")
+    parser.add_argument("--corpus", default=DEFAULT_CORPUS, help="语料文件（JSONL）")
+    parser.add_argument("-n", "--iterations", type=int, default=20000, help="随机变异的次数")
+    parser.add_argument("--seed", type=int, default=0, help="随机种子，失败时用同一个种子复现")
+    parser.add_argument("--repeat", type=int, default=2000, help="计时时语料重复解析的遍数")
+    parser.add_argument("--json", help="把结果另存为 JSON 文件")
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.corpus)
+    corpus_failures = check_corpus(corpus)
+    print(f"语料 {len(corpus)} 条，失败 {len(corpus_failures)} 条")
+    for name, problem in corpus_failures:
+        print(f"  {name}: {problem}")
+
+    fuzz_failures, parsed = fuzz(corpus, args.iterations, args.seed)
+    print(f"随机变异 {args.iterations} 次（种子 {args.seed}），解析出结果 {parsed} 次，失败 {len(fuzz_failures)} 次")
+    for name, problem, text in fuzz_failures[:20]:
+        print(f"  {name}: {problem}\n    输入: {text!r}")
+
+    per_parse = benchmark(corpus, args.repeat)
+    print(f"平均每次解析 {per_parse * 1e6:.2f}us")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({
+                "corpus": len(corpus),
+                "corpus_failures": [{"name": name, "problem": problem} for name, problem in corpus_failures],
+                "iterations": args.iterations,
+                "seed": args.seed,
+                "parsed": parsed,
+                "fuzz_failures": [{"name": name, "problem": problem, "input": text} for name, problem, text in fuzz_failures],
+                "parse_us": per_parse * 1e6,
+            }, f, ensure_ascii=False, indent=4)
+    if corpus_failures or fuzz_failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+import re
+
+# CJK 字符大致一个字符一个 token，其余文本大致四个字符一个 token
+_CJK_RE = re.compile(r"[\u3000-\u303f\u3400-\u4dbf\u4e00-\u9fff\uff00-\uffef]")
+# 每条消息的角色、分隔符等额外开销
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def estimate_tokens(text):
+    """粗略估算文本的 token 数，不依赖具体模型的分词器"""
+    cjk = len(_CJK_RE.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4 + MESSAGE_OVERHEAD_TOKENS
+
+
+class ConversationHistory:
+    """按角色记录的对话历史，带 token 预算、滑动窗口和可选的滚动摘要"""
+
+    def __init__(self, token_budget=2000, max_turns=20):
+        self.token_budget = token_budget
+        self.max_turns = max_turns
+        self.turns = []    # [{"role": ..., "content": ...}]
+        self.tokens = []   # 与 turns 一一对应的 token 估算值
+        self.summary = ""  # 被移出窗口的旧对话的摘要
+
+    def append(self, role, content):
+        self.turns.append({"role": role, "content": content})
+        self.tokens.append(estimate_tokens(content))
+
+    def total_tokens(self):
+        total = sum(self.tokens)
+        if self.summary:
+            total += estimate_tokens(self.summary)
+        return total
+
+    def trim(self):
+        """超出窗口或预算时从最早的对话开始移除，返回被移除的消息
+
+        超出预算时一次裁到预算的四分之三，避免之后每一轮都要裁剪（和重新摘要）。
+        """
+        dropped = []
+        if len(self.turns) > self.max_turns or self.total_tokens() > self.token_budget:
+            target = self.token_budget * 3 // 4
+            # 至少保留最近一条消息
+            while len(self.turns) > 1 and (len(self.turns) > self.max_turns or self.total_tokens() > target):
+                dropped.append(self.turns.pop(0))
+                self.tokens.pop(0)
+        return dropped
+
+    def to_messages(self):
+        """转换为 chat/completions 的 messages 列表"""
+        messages = []
+        if self.summary:
+            messages.append({"role": "system", "content": f"之前对话的摘要：\n{self.summary}"})
+        messages.extend(self.turns)
+        return messages
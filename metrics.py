@@ -0,0 +1,169 @@
+import json
+import math
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+# 直方图的桶上界（秒）
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# 计算面板上的百分位数时保留的最近样本数
+RECENT_SAMPLES = 1024
+
+
+class Histogram:
+    """固定桶的耗时直方图，另外保留最近的样本用于计算精确的百分位数"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.total = 0.0
+        self.recent = deque(maxlen=RECENT_SAMPLES)
+
+    def observe(self, value):
+        self.count += 1
+        self.total += value
+        self.recent.append(value)
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+                break
+
+    def percentile(self, p):
+        if not self.recent:
+            return 0.0
+        ordered = sorted(self.recent)
+        return ordered[max(0, min(len(ordered) - 1, math.ceil(p / 100.0 * len(ordered)) - 1))]
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "avg": self.total / self.count if self.count else 0.0,
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+            "p99": self.percentile(99),
+        }
+
+
+class Metrics:
+    """流水线各阶段的耗时和 token 用量统计
+
+    stage 计时写入直方图；在 begin_turn / end_turn 之间同一线程记录的数据还会汇总成一条
+    每轮记录，配置了 jsonl_path 时追加写入 JSONL 文件。
+    """
+
+    def __init__(self, jsonl_path=""):
+        self.jsonl_path = jsonl_path
+        self.histograms = {}  # 阶段 -> Histogram
+        self.tokens = {}      # (阶段, prompt/completion/total) -> token 数
+        self.counters = {}    # 名称 -> 计数
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def observe(self, stage, seconds):
+        with self._lock:
+            histogram = self.histograms.get(stage)
+            if histogram is None:
+                histogram = self.histograms[stage] = Histogram()
+            histogram.observe(seconds)
+        record = getattr(self._local, "record", None)
+        if record is not None:
+            record["timings"][stage] = record["timings"].get(stage, 0.0) + seconds
+
+    @contextmanager
+    def time(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def record_usage(self, stage, usage):
+        """记录响应中的 usage 字段"""
+        if not usage:
+            return
+        values = {
+            "prompt": usage.get("prompt_tokens") or 0,
+            "completion": usage.get("completion_tokens") or 0,
+            "total": usage.get("total_tokens") or 0,
+        }
+        with self._lock:
+            for kind, value in values.items():
+                self.tokens[(stage, kind)] = self.tokens.get((stage, kind), 0) + value
+        record = getattr(self._local, "record", None)
+        if record is not None:
+            record["usage"][stage] = values
+
+    def increment(self, name, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def begin_turn(self):
+        self._local.record = {"time": time.time(), "timings": {}, "usage": {}}
+
+    @contextmanager
+    def collect(self):
+        """在当前线程单独收集一段计时和 token 用量，不写入文件；结束后可以用 merge 并入某一轮的记录"""
+        previous = getattr(self._local, "record", None)
+        record = {"timings": {}, "usage": {}}
+        self._local.record = record
+        try:
+            yield record
+        finally:
+            self._local.record = previous
+
+    def merge(self, record):
+        """把 collect 收集到的数据并入当前线程这一轮的记录"""
+        current = getattr(self._local, "record", None)
+        if current is None or not record:
+            return
+        for stage, seconds in record["timings"].items():
+            current["timings"][stage] = current["timings"].get(stage, 0.0) + seconds
+        current["usage"].update(record["usage"])
+
+    def end_turn(self, **extra):
+        """结束当前线程的一轮记录，返回这条记录"""
+        record = getattr(self._local, "record", None)
+        self._local.record = None
+        if record is None:
+            return None
+        record.update(extra)
+        if self.jsonl_path:
+            line = json.dumps(record, ensure_ascii=False)
+            with self._lock:
+                with open(self.jsonl_path, "a", encoding="utf-8") as f:
+                    f.write(line + "\n")
+        return record
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "stages": {stage: histogram.summary() for stage, histogram in self.histograms.items()},
+                "tokens": {f"{stage}.{kind}": value for (stage, kind), value in self.tokens.items()},
+                "counters": dict(self.counters),
+            }
+
+    def to_prometheus(self):
+        """导出为 Prometheus 文本格式"""
+        lines = [
+            "# HELP heartchat_stage_seconds Wall time of each pipeline stage.",
+            "# TYPE heartchat_stage_seconds histogram",
+        ]
+        with self._lock:
+            for stage, histogram in sorted(self.histograms.items()):
+                cumulative = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    lines.append(f'heartchat_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+                lines.append(f'heartchat_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {histogram.count}')
+                lines.append(f'heartchat_stage_seconds_sum{{stage="{stage}"}} {histogram.total}')
+                lines.append(f'heartchat_stage_seconds_count{{stage="{stage}"}} {histogram.count}')
+            lines.append("# HELP heartchat_tokens_total Token usage reported by the API.")
+            lines.append("# TYPE heartchat_tokens_total counter")
+            for (stage, kind), value in sorted(self.tokens.items()):
+                lines.append(f'heartchat_tokens_total{{stage="{stage}",kind="{kind}"}} {value}')
+            lines.append("# TYPE heartchat_events_total counter")
+            for name, value in sorted(self.counters.items()):
+                lines.append(f'heartchat_events_total{{event="{name}"}} {value}')
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,198 @@
+"""本地的 OpenAI 兼容 chat/completions 模拟服务，用于离线测试和压测
+
+可以配置首字节延迟、输出速度、流式输出、错误注入，以及分析机器人返回的 ~!...!~ 内容。
+"""
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from history import estimate_tokens
+from protocol import REPLY_MARKER
+
+DEFAULT_ANALYSES = [
+    "~!modelparam:{temperature:[0.7],topp:[0.9]}!~\n"
+    "~!emoweight:{happiness:[0.5];anger:[0.1];fear:[0.2];sadness:[0.1];disgust:[0.0];surprise:[0.1]}!~\n"
+    "~!prompt:[语气轻松一些]!~",
+    "~!modelparam:{temperature:[0.9],topp:[0.95]}!~\n"
+    "~!emoweight:{happiness:[0.8];anger:[0.0];fear:[0.0];sadness:[0.0];disgust:[0.0];surprise:[0.3]}!~\n"
+    "~!prompt:[表现得很开心]!~",
+    "~!modelparam:{temperature:[0.5],topp:[0.8]}!~\n"
+    "~!emoweight:{happiness:[0.1];anger:[0.0];fear:[0.1];sadness:[0.6];disgust:[0.0];surprise:[0.0]}!~\n"
+    "~!prompt:[温柔地安慰对方]!~",
+]
+DEFAULT_REPLY = "我明白你的意思，谢谢你愿意和我分享这些。今天过得怎么样？有什么想聊的都可以告诉我。"
+
+
+class MockOptions:
+    """模拟服务的行为参数"""
+
+    def __init__(self, latency=0.05, token_rate=200.0, error_rate=0.0, reply_text=DEFAULT_REPLY,
+                 analyses=None, seed=None):
+        self.latency = latency          # 返回第一个字节前的等待时间（秒）
+        self.token_rate = token_rate    # 每秒输出的 token 数，0 表示不限速
+        self.error_rate = error_rate    # 返回 503 的概率
+        self.reply_text = reply_text
+        self.analyses = analyses or DEFAULT_ANALYSES
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+
+
+def _tokens(text):
+    # 中文按字切分，其余按空格切分，用来模拟逐 token 的输出速度
+    tokens = []
+    word = ""
+    for char in text:
+        if ord(char) > 0x2e80:
+            if word:
+                tokens.append(word)
+                word = ""
+            tokens.append(char)
+        else:
+            word += char
+            if char == " ":
+                tokens.append(word)
+                word = ""
+    if word:
+        tokens.append(word)
+    return tokens
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # 支持 keep-alive
+    options = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, data):
+        body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _write_chunk(self, data):
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+
+    def _completion_text(self, messages):
+        options = self.options
+        system = messages[0].get("content", "") if messages else ""
+        if "~!modelparam" not in system:
+            return options.reply_text
+        with options.lock:
+            analysis = options.random.choice(options.analyses)
+        if REPLY_MARKER in system:
+            return f"{analysis}\n{REPLY_MARKER}\n{options.reply_text}"
+        return analysis
+
+    def do_POST(self):
+        options = self.options
+        length = int(self.headers.get("Content-Length", 0))
+        try:
+            payload = json.loads(self.rfile.read(length))
+        except ValueError:
+            self._send_json(400, {"error": {"message": "invalid json"}})
+            return
+        with options.lock:
+            options.requests += 1
+            fail = options.random.random() < options.error_rate
+            if fail:
+                options.errors += 1
+        time.sleep(options.latency)
+        if fail:
+            self._send_json(503, {"error": {"message": "injected error"}})
+            return
+
+        messages = payload.get("messages", [])
+        text = self._completion_text(messages)
+        tokens = _tokens(text)
+        usage = {
+            "prompt_tokens": sum(estimate_tokens(message.get("content", "")) for message in messages),
+            "completion_tokens": len(tokens),
+        }
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+        delay = 1.0 / options.token_rate if options.token_rate > 0 else 0.0
+
+        if not payload.get("stream"):
+            time.sleep(delay * len(tokens))
+            self._send_json(200, {
+                "object": "chat.completion",
+                "model": payload.get("model"),
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+                "usage": usage,
+            })
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        try:
+            for token in tokens:
+                chunk = {"object": "chat.completion.chunk", "choices": [{"index": 0, "delta": {"content": token}}]}
+                self._write_chunk(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+                if delay:
+                    time.sleep(delay)
+            final = {"object": "chat.completion.chunk", "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}], "usage": usage}
+            self._write_chunk(f"data: {json.dumps(final)}\n\n".encode("utf-8"))
+            self._write_chunk(b"data: [DONE]\n\n")
+            self._write_chunk(b"")
+        except (BrokenPipeError, ConnectionResetError):
+            # 客户端取消了请求
+            self.close_connection = True
+
+
+class MockServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # 客户端重试或取消时会直接断开连接，这是预期行为，不打印堆栈
+        if isinstance(sys.exc_info()[1], (BrokenPipeError, ConnectionResetError)):
+            return
+        super().handle_error(request, client_address)
+
+
+def start_mock_server(options=None, host="127.0.0.1", port=0):
+    """在后台线程启动模拟服务，返回 (server, chat/completions 地址)"""
+    handler = type("BoundMockHandler", (MockHandler,), {"options": options or MockOptions()})
+    server = MockServer((host, port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}/v1/chat/completions"
+
+
+def load_analyses(path):
+    """读取自定义的分析输出，每个输出之间用空行分隔"""
+    with open(path, "r", encoding="utf-8") as f:
+        return [block.strip() for block in f.read().split("\n\n") if block.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地 OpenAI 兼容 chat/completions 模拟服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8808)
+    parser.add_argument("--latency", type=float, default=0.05, help="首字节延迟（秒）")
+    parser.add_argument("--token-rate", type=float, default=200.0, help="每秒输出的 token 数，0 表示不限速")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="返回 503 的概率")
+    parser.add_argument("--analyses", help="自定义分析输出的文件，每个输出之间用空行分隔")
+    args = parser.parse_args()
+
+    options = MockOptions(args.latency, args.token_rate, args.error_rate,
+                          analyses=load_analyses(args.analyses) if args.analyses else None)
+    server, url = start_mock_server(options, args.host, args.port)
+    print(f"模拟服务已启动: {url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
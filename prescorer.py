@@ -0,0 +1,206 @@
+"""本地情绪预评分：用词典特征估计六种情绪权重，置信度足够高时可以跳过远程的分析请求
+
+只依赖 CPU；安装了 NumPy 时批量评分走矩阵运算，没有时退回纯 Python 实现，结果相同。
+"""
+import math
+import re
+
+from protocol import DEFAULT_TOP_P, EMOTION_NAMES, AnalysisResult
+
+try:
+    import numpy as np
+except ImportError:  # NumPy 是可选依赖
+    np = None
+
+# 每种情绪的词条，默认权重 1.0
+BASE_TERMS = {
+    "happiness": (
+        "开心", "高兴", "快乐", "幸福", "哈哈", "嘿嘿", "喜欢", "爱你", "太好了", "好棒", "不错", "满意", "舒服",
+        "期待", "兴奋", "激动", "感谢", "谢谢", "好吃", "好玩", "顺利", "成功", "放假", "耶", "开森", "美滋滋",
+        "😊", "😄", "😁", "😆", "❤", "happy", "glad", "great", "love", "thanks",
+    ),
+    "anger": (
+        "生气", "气死", "愤怒", "烦死", "讨厌", "火大", "可恶", "混蛋", "受够", "凭什么", "过分", "恼火", "气人",
+        "滚", "垃圾", "无语", "😡", "😠", "angry", "hate", "annoyed",
+    ),
+    "fear": (
+        "害怕", "担心", "焦虑", "紧张", "恐怖", "吓人", "吓死", "不安", "心慌", "恐惧", "不敢", "噩梦", "忐忑", "怕",
+        "😨", "😰", "scared", "afraid", "worried", "anxious",
+    ),
+    "sadness": (
+        "难过", "伤心", "哭", "失落", "孤独", "寂寞", "想念", "遗憾", "委屈", "失望", "心痛", "痛苦", "郁闷",
+        "沮丧", "心累", "唉", "😢", "😭", "😞", "sad", "lonely", "cry",
+    ),
+    "disgust": (
+        "恶心", "反感", "嫌弃", "厌恶", "受不了", "鄙视", "作呕", "难吃", "膈应", "😒", "🤢", "gross", "disgusting",
+    ),
+    "surprise": (
+        "惊讶", "震惊", "居然", "竟然", "没想到", "天哪", "天啊", "真的吗", "不会吧", "意外", "吃惊", "哇",
+        "😮", "😲", "wow", "omg",
+    ),
+}
+# 带多种情绪或权重不为 1.0 的词条，覆盖 BASE_TERMS 中的同名词条
+MIXED_TERMS = {
+    "累": {"sadness": 0.6, "fear": 0.1},
+    "压力": {"fear": 0.6, "sadness": 0.3},
+    "分手": {"sadness": 1.0, "anger": 0.2},
+    "失败": {"sadness": 0.7, "fear": 0.2},
+    "烦": {"anger": 0.6, "sadness": 0.2},
+    "哭笑不得": {"surprise": 0.4, "sadness": 0.3, "happiness": 0.2},
+    "吓": {"fear": 0.7, "surprise": 0.3},
+    "惊喜": {"surprise": 0.8, "happiness": 0.6},
+}
+NEGATIONS = ("并不", "不是", "没有", "不", "没", "别")
+# 程度副词对后面词条的倍率
+MODIFIERS = {
+    "非常": 1.5, "特别": 1.5, "超级": 1.5, "十分": 1.5, "太": 1.5, "超": 1.4, "很": 1.3, "好": 1.3, "真": 1.3,
+    "有点": 0.6, "有些": 0.6, "稍微": 0.5,
+}
+# 主导情绪对应的回复提示
+EMOTION_PROMPTS = {
+    "happiness": "分享对方的喜悦，语气轻松愉快",
+    "anger": "先认同对方的感受，语气平和，不要火上浇油",
+    "fear": "给对方安全感，语气温和、稳定",
+    "sadness": "温柔地安慰对方，多一些共情",
+    "disgust": "理解对方的不适，避免细节描写",
+    "surprise": "回应对方的惊讶，语气生动一些",
+}
+NEUTRAL_PROMPT = "自然地回应对方"
+_SADNESS = EMOTION_NAMES.index("sadness")
+
+
+def build_lexicon():
+    """词条 -> {情绪: 权重}"""
+    lexicon = {}
+    for name, terms in BASE_TERMS.items():
+        for term in terms:
+            lexicon.setdefault(term, {})[name] = 1.0
+    lexicon.update(MIXED_TERMS)
+    return lexicon
+
+
+def _alternation(words):
+    # 长词优先，保证 "害怕" 不会被拆成 "怕"
+    return "|".join(_term_pattern(word) for word in sorted(words, key=len, reverse=True))
+
+
+def _term_pattern(word):
+    # 英文词条只匹配完整的单词，避免 "whatever" 命中 "hate"、"glove" 命中 "love"
+    if word.isascii() and word.isalpha():
+        return f"(?<![A-Za-z]){re.escape(word)}(?![A-Za-z])"
+    return re.escape(word)
+
+
+class EmotionPrescorer:
+    """词典特征 + 线性加权的情绪评分器
+
+    每条消息先用一个正则找出所有 (否定词)(程度副词)(词条) 命中，得到 消息 x 词条 的特征矩阵，
+    再乘以 词条 x 情绪 的权重矩阵，经过 1 - exp(-x) 压到 [0, 1] 得到情绪向量。
+    被否定的开心类词条（"不开心"）计入难过，其他被否定的词条只降低置信度。
+
+    置信度综合了命中的证据量、主导情绪的占比、词条覆盖消息的比例和否定词的比例，
+    长消息或情绪混杂的消息置信度较低，应交给远程分析。
+    """
+
+    def __init__(self, lexicon=None):
+        lexicon = lexicon or build_lexicon()
+        self.terms = sorted(lexicon, key=len, reverse=True)
+        self.index = {term.lower(): i for i, term in enumerate(self.terms)}
+        weights = [[lexicon[term].get(name, 0.0) for name in EMOTION_NAMES] for term in self.terms]
+        self.weights = np.array(weights) if np is not None else weights
+        self.pattern = re.compile(
+            f"(?P<neg>{_alternation(NEGATIONS)})?(?P<mod>{_alternation(MODIFIERS)})?(?P<term>{_alternation(self.terms)})",
+            re.I
+        )
+
+    def _features(self, messages):
+        """提取特征，返回 (命中列表 [(行, 词条, 倍率)], 每行的否定开心数, 否定数, 命中字符数, 感叹号数)"""
+        hits = []
+        n = len(messages)
+        negated_happy = [0.0] * n
+        negated = [0] * n
+        matched = [0] * n
+        exclaims = [0] * n
+        for row, message in enumerate(messages):
+            exclaims[row] = message.count("!") + message.count("！")
+            for match in self.pattern.finditer(message):
+                matched[row] += match.end() - match.start()
+                term = self.index[match.group("term").lower()]
+                scale = MODIFIERS.get(match.group("mod"), 1.0)
+                if match.group("neg"):
+                    negated[row] += 1
+                    if self.terms[term] in BASE_TERMS["happiness"]:
+                        negated_happy[row] += scale
+                    continue
+                hits.append((row, term, scale))
+        return hits, negated_happy, negated, matched, exclaims
+
+    def score_batch(self, messages):
+        """批量评分，返回 (情绪向量列表, 置信度列表)，情绪向量按 EMOTION_NAMES 的顺序"""
+        messages = [message or "" for message in messages]
+        if not messages:
+            return [], []
+        hits, negated_happy, negated, matched, exclaims = self._features(messages)
+        lengths = [max(1, len(message.strip())) for message in messages]
+        if np is not None:
+            return self._score_numpy(len(messages), hits, negated_happy, negated, matched, exclaims, lengths)
+        return self._score_python(len(messages), hits, negated_happy, negated, matched, exclaims, lengths)
+
+    def _score_numpy(self, n, hits, negated_happy, negated, matched, exclaims, lengths):
+        features = np.zeros((n, len(self.terms)))
+        if hits:
+            rows, cols, scales = zip(*hits)
+            np.add.at(features, (np.array(rows), np.array(cols)), np.array(scales))
+        raw = features @ self.weights
+        raw[:, _SADNESS] += 0.8 * np.array(negated_happy)
+        raw *= (1.0 + 0.15 * np.minimum(np.array(exclaims), 3))[:, None]
+        vectors = 1.0 - np.exp(-raw)
+
+        evidence = 1.0 - np.exp(-raw.sum(axis=1))
+        total = vectors.sum(axis=1)
+        purity = np.divide(vectors.max(axis=1), total, out=np.zeros(n), where=total > 0)
+        coverage = np.minimum(1.0, (np.array(matched) + 4.0) / np.array(lengths))
+        hit_counts = np.bincount(np.array([row for row, _, _ in hits], dtype=int), minlength=n) if hits else np.zeros(n)
+        negated = np.array(negated)
+        negation = 1.0 - 0.5 * np.divide(negated, hit_counts + negated, out=np.zeros(n), where=hit_counts + negated > 0)
+        confidence = evidence * purity * coverage * negation
+        return np.round(vectors, 2).tolist(), np.round(confidence, 3).tolist()
+
+    def _score_python(self, n, hits, negated_happy, negated, matched, exclaims, lengths):
+        raw = [[0.0] * len(EMOTION_NAMES) for _ in range(n)]
+        hit_counts = [0] * n
+        for row, term, scale in hits:
+            hit_counts[row] += 1
+            for column, weight in enumerate(self.weights[term]):
+                raw[row][column] += weight * scale
+        vectors = []
+        confidences = []
+        for row in range(n):
+            raw[row][_SADNESS] += 0.8 * negated_happy[row]
+            boost = 1.0 + 0.15 * min(exclaims[row], 3)
+            values = [value * boost for value in raw[row]]
+            vector = [1.0 - math.exp(-value) for value in values]
+            evidence = 1.0 - math.exp(-sum(values))
+            total = sum(vector)
+            purity = max(vector) / total if total > 0 else 0.0
+            coverage = min(1.0, (matched[row] + 4.0) / lengths[row])
+            seen = hit_counts[row] + negated[row]
+            negation = 1.0 - 0.5 * negated[row] / seen if seen else 1.0
+            vectors.append([round(value, 2) for value in vector])
+            confidences.append(round(evidence * purity * coverage * negation, 3))
+        return vectors, confidences
+
+    def to_analysis(self, vector):
+        """把情绪向量转换成 AnalysisResult，模型参数和提示词按情绪推导"""
+        emotions = dict(zip(EMOTION_NAMES, vector))
+        temperature = 0.7 + 0.3 * emotions["happiness"] + 0.2 * emotions["surprise"] \
+            - 0.2 * emotions["sadness"] - 0.2 * emotions["fear"] - 0.1 * emotions["anger"]
+        top_p = DEFAULT_TOP_P - 0.1 * max(emotions["anger"], emotions["fear"])
+        dominant = max(EMOTION_NAMES, key=emotions.get)
+        prompt = EMOTION_PROMPTS[dominant] if emotions[dominant] > 0 else NEUTRAL_PROMPT
+        return AnalysisResult(round(min(1.2, max(0.3, temperature)), 2), round(top_p, 2), emotions, prompt)
+
+    def score(self, message):
+        """给单条消息评分，返回 (AnalysisResult, 置信度)"""
+        vectors, confidences = self.score_batch([message])
+        return self.to_analysis(vectors[0]), confidences[0]
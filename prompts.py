@@ -0,0 +1,51 @@
+import os
+import threading
+
+
+class PromptStore:
+    """提示词文件的缓存：文件的 mtime 或大小变化时才重新读取，目录变化时才重新扫描"""
+
+    # 编译好的系统提示词最多保留的条数
+    MAX_COMPILED = 64
+
+    def __init__(self, directory="."):
+        self.directory = directory
+        self._files = {}         # 文件路径 -> (mtime_ns, 大小, 内容)
+        self._listing = []
+        self._listing_mtime = None
+        self._compiled = {}      # (模板名, 参数...) -> 编译好的提示词
+        self._lock = threading.Lock()
+
+    def read(self, path):
+        """读取提示词文件内容（去掉首尾空白），文件不存在时抛出 FileNotFoundError"""
+        stat = os.stat(path)
+        with self._lock:
+            entry = self._files.get(path)
+            if entry is not None and entry[0] == stat.st_mtime_ns and entry[1] == stat.st_size:
+                return entry[2]
+        with open(path, "r", encoding="utf-8") as f:
+            content = f.read().strip()
+        with self._lock:
+            self._files[path] = (stat.st_mtime_ns, stat.st_size, content)
+        return content
+
+    def list_files(self):
+        """列出目录下所有 .txt 提示词文件，目录内容变化时才重新扫描"""
+        mtime = os.stat(self.directory).st_mtime_ns
+        with self._lock:
+            if mtime != self._listing_mtime:
+                self._listing = sorted(f for f in os.listdir(self.directory) if f.endswith(".txt"))
+                self._listing_mtime = mtime
+            return list(self._listing)
+
+    def compile(self, key, build):
+        """按 key 缓存 build() 生成的提示词，相同输入得到逐字节相同的结果"""
+        with self._lock:
+            prompt = self._compiled.get(key)
+        if prompt is None:
+            prompt = build()
+            with self._lock:
+                if len(self._compiled) >= self.MAX_COMPILED:
+                    self._compiled.clear()
+                self._compiled[key] = prompt
+        return prompt
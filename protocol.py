@@ -0,0 +1,107 @@
+import re
+
+EMOTION_NAMES = ("happiness", "anger", "fear", "sadness", "disgust", "surprise")
+DEFAULT_TEMPERATURE = 0.7
+DEFAULT_TOP_P = 0.9
+# 合并模式下分析区块和回复之间的分隔标记
+REPLY_MARKER = "~!reply!~"
+
+# 一次扫描同时匹配三个区块：~!modelparam:...!~、~!emoweight:...!~、~!prompt:[...]!~
+_BLOCK_RE = re.compile(r"~!(modelparam|emoweight):(.*?)!~|~!prompt:\[(.*?)\]!~", re.S)
+_FIELD_RE = re.compile(r"(\w+):\[\s*([-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)\s*\]")
+
+
+def _clamp(value, low, high):
+    return low if value < low else high if value > high else value
+
+
+class AnalysisResult:
+    """Robot1 的分析结果：模型参数、六种情绪权重和提示词"""
+
+    __slots__ = ("temperature", "top_p", "happiness", "anger", "fear", "sadness", "disgust", "surprise", "prompt")
+
+    def __init__(self, temperature=DEFAULT_TEMPERATURE, top_p=DEFAULT_TOP_P, emotions=None, prompt=""):
+        # 超出范围的值截断到合法区间，而不是把整个结果判为无效
+        self.temperature = _clamp(float(temperature), 0.0, 2.0)
+        self.top_p = _clamp(float(top_p), 0.0, 1.0)
+        emotions = emotions or {}
+        for name in EMOTION_NAMES:
+            setattr(self, name, _clamp(float(emotions.get(name, 0.0)), 0.0, 1.0))
+        self.prompt = prompt
+
+    def emotions(self):
+        """按固定顺序返回情绪权重字典"""
+        return {name: getattr(self, name) for name in EMOTION_NAMES}
+
+    def emotion_vector(self):
+        return tuple(getattr(self, name) for name in EMOTION_NAMES)
+
+    def format_model_params(self):
+        return f"~!modelparam:{{temperature:[{self.temperature}],topp:[{self.top_p}]}}!~"
+
+    def format_emotion_weight(self):
+        fields = ";".join(f"{name}:[{getattr(self, name)}]" for name in EMOTION_NAMES)
+        return f"~!emoweight:{{{fields}}}!~"
+
+    def format(self):
+        """还原成协议格式的文本"""
+        return f"{self.format_model_params()}\n{self.format_emotion_weight()}\n~!prompt:[{self.prompt}]!~"
+
+    def to_dict(self):
+        return {
+            "temperature": self.temperature,
+            "top_p": self.top_p,
+            "emotions": self.emotions(),
+            "prompt": self.prompt,
+        }
+
+    def __repr__(self):
+        return f"AnalysisResult({self.to_dict()!r})"
+
+
+def emotion_distance(a, b):
+    """两个分析结果情绪向量之间的欧氏距离"""
+    return sum((x - y) ** 2 for x, y in zip(a.emotion_vector(), b.emotion_vector())) ** 0.5
+
+
+def _parse_fields(text):
+    fields = {}
+    for key, value in _FIELD_RE.findall(text):
+        try:
+            fields[key] = float(value)
+        except ValueError:
+            continue
+    return fields
+
+
+def parse_analysis(response):
+    """单次扫描解析 Robot1 的输出，缺少任意一个区块时返回 None"""
+    model_params = emotion_weight = prompt = None
+    for match in _BLOCK_RE.finditer(response):
+        name = match.group(1)
+        # 同一区块出现多次时以第一次为准
+        if name == "modelparam":
+            if model_params is None:
+                model_params = match.group(2)
+        elif name == "emoweight":
+            if emotion_weight is None:
+                emotion_weight = match.group(2)
+        elif prompt is None:
+            prompt = match.group(3)
+    if model_params is None or emotion_weight is None or prompt is None:
+        return None
+    params = _parse_fields(model_params)
+    return AnalysisResult(
+        temperature=params.get("temperature", DEFAULT_TEMPERATURE),
+        top_p=params.get("topp", DEFAULT_TOP_P),
+        emotions=_parse_fields(emotion_weight),
+        prompt=prompt.replace("[", "").replace("]", ""),
+    )
+
+
+def split_fused(response):
+    """把合并模式的输出拆成 (分析部分, 回复部分)，还没有出现回复标记时回复部分为 None"""
+    index = response.find(REPLY_MARKER)
+    if index < 0:
+        return response, None
+    return response[:index], response[index + len(REPLY_MARKER):]
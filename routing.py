@@ -0,0 +1,164 @@
+import random
+import threading
+import time
+
+from transport import RETRY_BACKOFF_MAX, RETRY_STATUS_CODES, is_connect_error, retry_after
+
+# 这些状态码说明端点本身不可用或配置有误，换一个端点可能就能成功
+FAILOVER_STATUS_CODES = RETRY_STATUS_CODES + (401, 403, 404)
+
+ANALYSIS = "analysis"
+REPLY = "reply"
+
+
+class Endpoint:
+    """一个上游端点（地址 + key + 模型）及其健康状态和最近的延迟"""
+
+    def __init__(self, url, api_key, model, name=""):
+        self.url = url
+        self.api_key = api_key
+        self.model = model
+        self.name = name or f"{model}@{url}"
+        self.latency = None        # 最近延迟的指数移动平均（秒），还没有成功过时为 None
+        self.failures = 0          # 连续失败次数
+        self.cooldown_until = 0.0  # 在此之前（time.monotonic）不优先选择这个端点
+        self.requests = 0
+        self.errors = 0
+
+    def available(self, now):
+        return now >= self.cooldown_until
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "model": self.model,
+            "latency": self.latency,
+            "failures": self.failures,
+            "requests": self.requests,
+            "errors": self.errors,
+            "cooling_down": not self.available(time.monotonic()),
+        }
+
+
+class Router:
+    """按阶段选择上游端点
+
+    分析和回复各自有一组端点，没有配置时都使用 api_url / api_key / model。
+    每次请求按最近延迟从低到高尝试可用的端点，连接失败或返回 FAILOVER_STATUS_CODES 时换下一个；
+    连续失败达到阈值的端点进入冷却期，期间排在最后，只有其他端点都失败时才会用到。
+    后面还有端点可以切换时失败就立即切换，只有最后一个端点在连接失败或返回 RETRY_STATUS_CODES 时
+    按 max_retries 退避重试（优先使用响应头 Retry-After 的等待时间）。
+    """
+
+    def __init__(self, config, transport, metrics=None):
+        self.config = config
+        self.transport = transport
+        self.metrics = metrics
+        self._endpoints = {}  # (url, api_key, model) -> Endpoint，配置变化后健康状态仍然保留
+        self._lock = threading.Lock()
+        self._random = random.Random()
+
+    def _configured(self, stage):
+        configured = self.config.analysis_endpoints if stage == ANALYSIS else self.config.reply_endpoints
+        if configured:
+            return [(item.url, item.api_key, item.model, item.name) for item in configured]
+        return [(self.config.api_url, self.config.api_key, self.config.model, "")]
+
+    def endpoints(self, stage):
+        """当前配置下这个阶段的所有端点"""
+        endpoints = []
+        with self._lock:
+            for url, api_key, model, name in self._configured(stage):
+                endpoint = self._endpoints.get((url, api_key, model))
+                if endpoint is None:
+                    endpoint = self._endpoints[(url, api_key, model)] = Endpoint(url, api_key, model, name)
+                endpoints.append(endpoint)
+        return endpoints
+
+    def signature(self, stage):
+        """这个阶段的端点和模型，用于区分不同配置下的缓存"""
+        return "|".join(f"{url}#{model}" for url, _, model, _ in self._configured(stage))
+
+    def candidates(self, stage):
+        """按尝试顺序排列的端点：还没测过延迟的优先，其次按延迟从低到高，冷却中的排在最后"""
+        now = time.monotonic()
+        endpoints = self.endpoints(stage)
+        with self._lock:
+            ready = [endpoint for endpoint in endpoints if endpoint.available(now)]
+            cooling = [endpoint for endpoint in endpoints if not endpoint.available(now)]
+            ready.sort(key=lambda endpoint: -1.0 if endpoint.latency is None else endpoint.latency)
+            cooling.sort(key=lambda endpoint: endpoint.cooldown_until)
+            # 偶尔先试一个不是最快的端点，让它的延迟数据保持更新
+            if len(ready) > 1 and self._random.random() < self.config.route_explore_rate:
+                ready.insert(0, ready.pop(self._random.randrange(1, len(ready))))
+        return ready + cooling
+
+    def _record_success(self, endpoint, latency):
+        alpha = self.config.route_latency_alpha
+        with self._lock:
+            endpoint.requests += 1
+            endpoint.failures = 0
+            endpoint.cooldown_until = 0.0
+            endpoint.latency = latency if endpoint.latency is None else alpha * latency + (1 - alpha) * endpoint.latency
+
+    def _record_failure(self, endpoint):
+        with self._lock:
+            endpoint.requests += 1
+            endpoint.errors += 1
+            endpoint.failures += 1
+            if endpoint.failures >= self.config.route_failure_threshold:
+                endpoint.cooldown_until = time.monotonic() + self.config.route_failure_cooldown
+
+    def post(self, stage, payload, stream=False):
+        """把请求发给这个阶段最合适的端点，失败时依次换下一个，payload 中的 model 按端点替换
+
+        所有端点都失败时返回最后一个响应，或者抛出最后一个异常。
+        """
+        last_error = None
+        last_response = None
+        candidates = self.candidates(stage)
+        for index, endpoint in enumerate(candidates):
+            if index and self.metrics is not None:
+                self.metrics.increment(f"{stage}_failover")
+            request = dict(payload, model=endpoint.model)
+            retries = self.config.max_retries if index == len(candidates) - 1 else 0
+            delay = None
+            for attempt in range(retries + 1):
+                if attempt:
+                    time.sleep(delay if delay is not None else self._backoff(attempt))
+                    if self.metrics is not None:
+                        self.metrics.increment(f"{stage}_retry")
+                start = time.perf_counter()
+                try:
+                    response = self.transport.post(endpoint.url, endpoint.api_key, request, stream)
+                except Exception as e:
+                    last_error = e
+                    delay = None
+                    # 读超时等请求已经发出的错误不重试，避免同一个生成请求被重复计费
+                    if is_connect_error(e):
+                        continue
+                    break
+                if response.status_code in FAILOVER_STATUS_CODES:
+                    if last_response is not None:
+                        last_response.close()
+                    last_response = response
+                    delay = retry_after(response)
+                    if response.status_code in RETRY_STATUS_CODES:
+                        continue
+                    break
+                # 流式请求记录的是收到响应头的时间
+                self._record_success(endpoint, time.perf_counter() - start)
+                if last_response is not None:
+                    last_response.close()
+                return response
+            self._record_failure(endpoint)
+        if last_response is not None:
+            return last_response
+        raise last_error
+
+    def _backoff(self, attempt):
+        return min(RETRY_BACKOFF_MAX, self.config.retry_backoff * 2 ** (attempt - 1))
+
+    def stats(self):
+        with self._lock:
+            return [endpoint.to_dict() for endpoint in self._endpoints.values()]
@@ -0,0 +1,75 @@
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+class Turn:
+    """提交给调度器的一轮对话任务"""
+
+    def __init__(self, fn):
+        self.fn = fn                     # fn(cancel)，cancel 是 threading.Event
+        self.cancel = threading.Event()
+
+
+class TurnScheduler:
+    """有界线程池 + 每个对话一个有序队列
+
+    同一个对话的任务严格按提交顺序逐个执行，不同对话之间并行。
+    开启 cancel_superseded 时，新任务会取消同一对话中正在执行和排队的旧任务。
+    """
+
+    def __init__(self, max_workers=2, cancel_superseded=True):
+        self.cancel_superseded = cancel_superseded
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="turn")
+        self._lock = threading.Lock()
+        self._queues = {}   # 对话 id -> 等待执行的 Turn 队列
+        self._running = {}  # 对话 id -> 正在执行的 Turn
+
+    def submit(self, conversation_id, fn):
+        turn = Turn(fn)
+        with self._lock:
+            queue = self._queues.setdefault(conversation_id, deque())
+            if self.cancel_superseded:
+                running = self._running.get(conversation_id)
+                if running is not None:
+                    running.cancel.set()
+                # 排队中的旧任务直接丢弃，不再占用线程
+                for stale in queue:
+                    stale.cancel.set()
+                queue.clear()
+            queue.append(turn)
+            if conversation_id not in self._running:
+                self._start_next(conversation_id)
+        return turn
+
+    def _start_next(self, conversation_id):
+        """调用时必须持有 self._lock"""
+        queue = self._queues.get(conversation_id)
+        if not queue:
+            self._queues.pop(conversation_id, None)
+            return
+        turn = queue.popleft()
+        self._running[conversation_id] = turn
+        self._executor.submit(self._run, conversation_id, turn)
+
+    def _run(self, conversation_id, turn):
+        try:
+            if not turn.cancel.is_set():
+                turn.fn(turn.cancel)
+        finally:
+            with self._lock:
+                self._running.pop(conversation_id, None)
+                self._start_next(conversation_id)
+
+    def cancel_all(self):
+        with self._lock:
+            for turn in self._running.values():
+                turn.cancel.set()
+            for queue in self._queues.values():
+                for turn in queue:
+                    turn.cancel.set()
+                queue.clear()
+
+    def shutdown(self):
+        self.cancel_all()
+        self._executor.shutdown(wait=False)
@@ -0,0 +1,531 @@
+"""多会话服务模式：通过 HTTP 和 WebSocket 对外提供 分析 -> 回复 流水线
+
+接口：
+    POST   /sessions/{id}/messages  请求体 {"message": "..."}，返回这一轮的结果
+    GET    /sessions/{id}           会话状态
+    DELETE /sessions/{id}           结束会话，取消还在进行的请求
+    GET    /metrics                 Prometheus 文本格式的统计数据
+    GET    /healthz
+    WS     /ws?session={id}         发送 {"message": "..."} 或 {"type": "cancel"}，
+                                    推送 session / analysis / delta / reply / cancelled / error 事件
+
+每个会话有独立的历史和上一轮的分析结果，同一会话的轮次按顺序执行，空闲超时后从内存中移除。
+同时进行的对话轮数受 server_max_upstream 限制，每个 WebSocket 连接未完成的轮数受 server_ws_max_pending 限制。
+"""
+import argparse
+import asyncio
+import base64
+import functools
+import hashlib
+import json
+import re
+import struct
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from urllib.parse import parse_qs, urlsplit
+
+from config import Config
+from engine import PipelineEngine, PipelineError, Session, TurnCancelled
+from store import ConversationStore
+
+WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+MAX_BODY = 1 << 20  # 请求体和 WebSocket 消息的大小上限
+MAX_HEADERS = 64  # 请求头的行数上限
+MAX_HEADER_BYTES = 16 << 10  # 请求头的总大小上限
+SESSION_ID_RE = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+SESSION_PATH_RE = re.compile(r"^/sessions/([^/]+)(/messages)?$")
+
+# WebSocket 帧类型
+OP_CONTINUATION = 0x0
+OP_TEXT = 0x1
+OP_BINARY = 0x2
+OP_CLOSE = 0x8
+OP_PING = 0x9
+OP_PONG = 0xA
+
+
+class HttpError(Exception):
+    def __init__(self, status, message=None):
+        super().__init__(message or HTTPStatus(status).phrase)
+        self.status = status
+
+
+class Request:
+    def __init__(self, method, target, headers, body):
+        parts = urlsplit(target)
+        self.method = method
+        self.path = parts.path
+        self.query = {key: values[0] for key, values in parse_qs(parts.query).items()}
+        self.headers = headers  # 名称统一转成小写
+        self.body = body
+
+    def json(self):
+        try:
+            return json.loads(self.body or b"{}")
+        except ValueError:
+            raise HttpError(400, "请求体不是合法的 JSON")
+
+    def keep_alive(self):
+        return self.headers.get("connection", "").lower() != "close"
+
+
+async def _readline(reader, status):
+    """读取一行，超过 StreamReader 的长度限制时按 status 返回错误"""
+    try:
+        return await reader.readline()
+    except (asyncio.LimitOverrunError, ValueError):
+        raise HttpError(status)
+
+
+async def read_request(reader):
+    """读取一个 HTTP/1.1 请求，连接关闭时返回 None"""
+    line = await _readline(reader, 414)
+    if not line:
+        return None
+    try:
+        method, target, _ = line.decode("latin-1").split()
+    except ValueError:
+        raise HttpError(400)
+    headers = {}
+    count = size = 0
+    while True:
+        line = await _readline(reader, 431)
+        if line in (b"\r\n", b"\n", b""):
+            break
+        count += 1
+        size += len(line)
+        if count > MAX_HEADERS or size > MAX_HEADER_BYTES:
+            raise HttpError(431)
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    try:
+        length = int(headers.get("content-length") or 0)
+    except ValueError:
+        raise HttpError(400, "Content-Length 不是合法的整数")
+    if length < 0:
+        raise HttpError(400, "Content-Length 不能为负数")
+    if length > MAX_BODY:
+        raise HttpError(413)
+    body = await reader.readexactly(length) if length else b""
+    return Request(method.upper(), target, headers, body)
+
+
+def encode_response(status, body, content_type="application/json; charset=utf-8", keep_alive=True):
+    head = (
+        f"HTTP/1.1 {status} {HTTPStatus(status).phrase}\r\n"
+        f"Content-Type: {content_type}\r\n"
+        f"Content-Length: {len(body)}\r\n"
+        f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+    )
+    return head.encode("latin-1") + body
+
+
+def json_body(data):
+    return json.dumps(data, ensure_ascii=False).encode("utf-8")
+
+
+def encode_frame(opcode, payload):
+    """服务端发出的帧不加掩码"""
+    length = len(payload)
+    if length < 126:
+        head = struct.pack("!BB", 0x80 | opcode, length)
+    elif length < 1 << 16:
+        head = struct.pack("!BBH", 0x80 | opcode, 126, length)
+    else:
+        head = struct.pack("!BBQ", 0x80 | opcode, 127, length)
+    return head + payload
+
+
+def _unmask(data, mask):
+    # 整段按大整数异或，比逐字节循环快得多
+    length = len(data)
+    key = (mask * (length // 4 + 1))[:length]
+    return (int.from_bytes(data, "big") ^ int.from_bytes(key, "big")).to_bytes(length, "big")
+
+
+async def read_message(reader):
+    """读取一条完整的 WebSocket 消息（合并分片），返回 (opcode, payload)"""
+    opcode = None
+    parts = []
+    size = 0
+    while True:
+        first, second = await reader.readexactly(2)
+        fin = first & 0x80
+        frame_opcode = first & 0x0F
+        length = second & 0x7F
+        if length == 126:
+            length = struct.unpack("!H", await reader.readexactly(2))[0]
+        elif length == 127:
+            length = struct.unpack("!Q", await reader.readexactly(8))[0]
+        size += length
+        if size > MAX_BODY:
+            raise HttpError(413)
+        mask = await reader.readexactly(4) if second & 0x80 else None
+        data = await reader.readexactly(length)
+        if mask:
+            data = _unmask(data, mask)
+        if frame_opcode >= OP_CLOSE:
+            # 控制帧可以夹在分片之间，单独返回
+            return frame_opcode, data
+        if frame_opcode != OP_CONTINUATION:
+            opcode = frame_opcode
+        parts.append(data)
+        if fin:
+            return opcode, b"".join(parts)
+
+
+class ServerSession:
+    """服务模式下的一个会话：流水线状态 + 订阅这个会话事件的 WebSocket 连接"""
+
+    def __init__(self, session_id, session):
+        self.session_id = session_id
+        self.session = session
+        self.lock = asyncio.Lock()  # 同一会话的轮次按顺序执行
+        self.subscribers = set()    # 每个 WebSocket 连接一个 asyncio.Queue
+        self.cancels = set()        # 还没完成的轮次的取消标志
+        self.last_active = time.monotonic()
+
+    def touch(self):
+        self.last_active = time.monotonic()
+
+    def busy(self):
+        return bool(self.subscribers or self.cancels)
+
+    def broadcast(self, event):
+        """只能在事件循环线程中调用"""
+        for queue in self.subscribers:
+            queue.put_nowait(event)
+
+    def cancel_all(self):
+        for cancel in self.cancels:
+            cancel.set()
+
+
+class SessionManager:
+    """按会话 id 保存 ServerSession，空闲超时或超过数量上限时移除最久没有活动的会话"""
+
+    def __init__(self, engine, config):
+        self.engine = engine
+        self.config = config
+        self.sessions = {}
+
+    def get(self, session_id):
+        return self.sessions.get(session_id)
+
+    async def open(self, session_id):
+        state = self.sessions.get(session_id)
+        if state is not None:
+            state.touch()
+            return state
+        if len(self.sessions) >= self.config.server_max_sessions and not self._evict_oldest():
+            raise HttpError(503, "会话数已达上限")
+        session = Session(self.config, session_id)
+        # 从对话记录恢复历史需要读 SQLite，放到线程中执行
+        await asyncio.to_thread(self.engine.restore_session, session)
+        # 等待期间可能有同一 id 的请求已经创建了会话
+        state = self.sessions.get(session_id)
+        if state is None:
+            state = self.sessions[session_id] = ServerSession(session_id, session)
+        state.touch()
+        return state
+
+    def close(self, session_id):
+        state = self.sessions.pop(session_id, None)
+        if state is not None:
+            state.cancel_all()
+            state.broadcast({"type": "closed"})
+        return state is not None
+
+    def _evict_oldest(self):
+        idle = [state for state in self.sessions.values() if not state.busy()]
+        if not idle:
+            return False
+        oldest = min(idle, key=lambda state: state.last_active)
+        del self.sessions[oldest.session_id]
+        return True
+
+    def evict_idle(self):
+        deadline = time.monotonic() - self.config.server_session_idle_timeout
+        expired = [
+            session_id for session_id, state in self.sessions.items()
+            if not state.busy() and state.last_active < deadline
+        ]
+        for session_id in expired:
+            del self.sessions[session_id]
+        return len(expired)
+
+    async def run_evictor(self):
+        interval = min(60.0, max(1.0, self.config.server_session_idle_timeout / 4))
+        while True:
+            await asyncio.sleep(interval)
+            self.evict_idle()
+
+
+class PipelineServer:
+    def __init__(self, config, engine=None):
+        self.config = config
+        # 连接池至少要容纳所有并发的上游请求
+        config.pool_size = max(config.pool_size, config.server_max_upstream)
+        store = ConversationStore(config.store_path) if config.store_path else None
+        self.engine = engine or PipelineEngine(config, store=store)
+        self.sessions = SessionManager(self.engine, config)
+        self.upstream = asyncio.Semaphore(config.server_max_upstream)
+        self.executor = ThreadPoolExecutor(max_workers=config.server_max_upstream, thread_name_prefix="turn")
+        self.in_flight = 0
+        self.server = None
+
+    async def run_turn(self, state, user_message, cancel):
+        """执行一轮对话，分析结果和回复片段实时推送给这个会话的所有订阅者"""
+        loop = asyncio.get_running_loop()
+
+        def emit(event):
+            loop.call_soon_threadsafe(state.broadcast, event)
+
+        def on_analysis(analysis):
+            event = {"type": "analysis"}
+            event.update(analysis.to_dict())
+            emit(event)
+
+        state.cancels.add(cancel)
+        try:
+            async with state.lock:
+                async with self.upstream:
+                    self.in_flight += 1
+                    try:
+                        result = await loop.run_in_executor(self.executor, functools.partial(
+                            self.engine.run_turn, state.session, user_message,
+                            on_analysis=on_analysis,
+                            on_delta=lambda delta: emit({"type": "delta", "text": delta}),
+                            cancel=cancel
+                        ))
+                    finally:
+                        self.in_flight -= 1
+        finally:
+            state.cancels.discard(cancel)
+            state.touch()
+        event = {"type": "reply", "turn_id": result.turn_id}
+        event.update(result.to_dict())
+        state.broadcast(event)
+        return result
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                try:
+                    request = await read_request(reader)
+                except HttpError as e:
+                    writer.write(encode_response(e.status, json_body({"error": str(e)}), keep_alive=False))
+                    break
+                if request is None:
+                    break
+                if request.path == "/ws" and request.headers.get("upgrade", "").lower() == "websocket":
+                    await self.handle_websocket(request, reader, writer)
+                    break
+                try:
+                    status, body, content_type = await self.dispatch(request)
+                except HttpError as e:
+                    status, body, content_type = e.status, json_body({"error": str(e)}), "application/json; charset=utf-8"
+                writer.write(encode_response(status, body, content_type, request.keep_alive()))
+                await writer.drain()
+                if not request.keep_alive():
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def dispatch(self, request):
+        """处理普通 HTTP 请求，返回 (状态码, 响应体, Content-Type)"""
+        if request.path == "/healthz" and request.method == "GET":
+            return 200, json_body({"status": "ok", "sessions": len(self.sessions.sessions)}), "application/json; charset=utf-8"
+        if request.path == "/metrics" and request.method == "GET":
+            text = self.engine.metrics.to_prometheus() + self.engine.analysis_cache.to_prometheus() + (
+                f"# TYPE heartchat_sessions gauge\nheartchat_sessions {len(self.sessions.sessions)}\n"
+                f"# TYPE heartchat_upstream_in_flight gauge\nheartchat_upstream_in_flight {self.in_flight}\n"
+            )
+            return 200, text.encode("utf-8"), "text/plain; version=0.0.4; charset=utf-8"
+        match = SESSION_PATH_RE.match(request.path)
+        if match is None:
+            raise HttpError(404)
+        session_id, messages = match.groups()
+        if not SESSION_ID_RE.match(session_id):
+            raise HttpError(400, "会话 id 只能包含字母、数字、下划线和短横线")
+        if messages:
+            if request.method != "POST":
+                raise HttpError(405)
+            return await self.post_message(session_id, request.json())
+        if request.method == "GET":
+            state = self.sessions.get(session_id)
+            if state is None:
+                raise HttpError(404, "会话不存在")
+            return 200, json_body(self.describe(state)), "application/json; charset=utf-8"
+        if request.method == "DELETE":
+            if not self.sessions.close(session_id):
+                raise HttpError(404, "会话不存在")
+            return 200, json_body({"closed": session_id}), "application/json; charset=utf-8"
+        raise HttpError(405)
+
+    def describe(self, state):
+        session = state.session
+        return {
+            "session": state.session_id,
+            "turns": len(session.history.turns),
+            "last_reply": session.last_robot_reply,
+            "last_analysis": session.last_analysis.to_dict() if session.last_analysis else None,
+            "mood": session.timeline.stats(),
+            "running": len(state.cancels),
+            "subscribers": len(state.subscribers),
+        }
+
+    async def post_message(self, session_id, data):
+        user_message = data.get("message") if isinstance(data, dict) else None
+        if not isinstance(user_message, str) or not user_message:
+            raise HttpError(400, "缺少 message")
+        state = await self.sessions.open(session_id)
+        try:
+            result = await self.run_turn(state, user_message, threading.Event())
+        except TurnCancelled as e:
+            return 409, json_body({"stage": e.stage, "error": str(e)}), "application/json; charset=utf-8"
+        except PipelineError as e:
+            state.broadcast({"type": "error", "stage": e.stage, "message": str(e)})
+            return 502, json_body({"stage": e.stage, "error": str(e)}), "application/json; charset=utf-8"
+        data = {"turn_id": result.turn_id}
+        data.update(result.to_dict())
+        return 200, json_body(data), "application/json; charset=utf-8"
+
+    async def handle_websocket(self, request, reader, writer):
+        key = request.headers.get("sec-websocket-key")
+        session_id = request.query.get("session") or uuid.uuid4().hex
+        if not key or not SESSION_ID_RE.match(session_id):
+            writer.write(encode_response(400, json_body({"error": "WebSocket 握手参数不正确"}), keep_alive=False))
+            return
+        try:
+            state = await self.sessions.open(session_id)
+        except HttpError as e:
+            writer.write(encode_response(e.status, json_body({"error": str(e)}), keep_alive=False))
+            return
+        accept = base64.b64encode(hashlib.sha1((key + WS_GUID).encode("latin-1")).digest()).decode("latin-1")
+        writer.write((
+            "HTTP/1.1 101 Switching Protocols\r\n"
+            "Upgrade: websocket\r\n"
+            "Connection: Upgrade\r\n"
+            f"Sec-WebSocket-Accept: {accept}\r\n\r\n"
+        ).encode("latin-1"))
+
+        queue = asyncio.Queue()
+        state.subscribers.add(queue)
+        self.engine.metrics.increment("server_ws_connections")
+        queue.put_nowait({"type": "session", "session": session_id})
+        sender = asyncio.create_task(self._ws_sender(queue, writer))
+        cancels = set()  # 这个连接发起的、还没完成的轮次
+        tasks = set()
+        try:
+            while True:
+                opcode, payload = await read_message(reader)
+                if opcode == OP_CLOSE:
+                    writer.write(encode_frame(OP_CLOSE, payload[:2]))
+                    break
+                if opcode == OP_PING:
+                    writer.write(encode_frame(OP_PONG, payload))
+                    continue
+                if opcode != OP_TEXT:
+                    continue
+                state.touch()
+                try:
+                    data = json.loads(payload)
+                except ValueError:
+                    queue.put_nowait({"type": "error", "stage": "request", "message": "消息不是合法的 JSON"})
+                    continue
+                if not isinstance(data, dict):
+                    queue.put_nowait({"type": "error", "stage": "request", "message": "消息必须是 JSON 对象"})
+                    continue
+                if data.get("type") == "cancel":
+                    for cancel in cancels:
+                        cancel.set()
+                    continue
+                user_message = data.get("message")
+                if not isinstance(user_message, str) or not user_message:
+                    queue.put_nowait({"type": "error", "stage": "request", "message": "缺少 message"})
+                    continue
+                # 排队的轮次都会发出付费的上游请求，也会让会话一直处于忙碌状态无法回收
+                if len(tasks) >= self.config.server_ws_max_pending:
+                    self.engine.metrics.increment("server_ws_rejected")
+                    queue.put_nowait({"type": "error", "stage": "request", "message": "未完成的消息过多，请稍后再发送"})
+                    continue
+                cancel = threading.Event()
+                cancels.add(cancel)
+                task = asyncio.create_task(self._ws_turn(state, user_message, cancel, queue))
+                tasks.add(task)
+                task.add_done_callback(lambda task, cancel=cancel: (tasks.discard(task), cancels.discard(cancel)))
+        except (asyncio.IncompleteReadError, ConnectionError, HttpError):
+            pass
+        finally:
+            # 连接断开后它发起的请求已经没有人接收，直接取消以免占用上游
+            for cancel in cancels:
+                cancel.set()
+            state.subscribers.discard(queue)
+            state.touch()
+            sender.cancel()
+
+    async def _ws_turn(self, state, user_message, cancel, queue):
+        try:
+            await self.run_turn(state, user_message, cancel)
+        except TurnCancelled:
+            queue.put_nowait({"type": "cancelled"})
+        except PipelineError as e:
+            state.broadcast({"type": "error", "stage": e.stage, "message": str(e)})
+
+    async def _ws_sender(self, queue, writer):
+        try:
+            while True:
+                event = await queue.get()
+                writer.write(encode_frame(OP_TEXT, json_body(event)))
+                # 积压的事件一次写完再等待发送缓冲区
+                while not queue.empty():
+                    writer.write(encode_frame(OP_TEXT, json_body(queue.get_nowait())))
+                await writer.drain()
+        except ConnectionError:
+            pass
+
+    async def serve(self, host=None, port=None):
+        self.server = await asyncio.start_server(
+            self.handle_connection, host or self.config.server_host, port or self.config.server_port
+        )
+        evictor = asyncio.create_task(self.sessions.run_evictor())
+        try:
+            async with self.server:
+                await self.server.serve_forever()
+        finally:
+            evictor.cancel()
+            self.close()
+
+    def close(self):
+        for state in self.sessions.sessions.values():
+            state.cancel_all()
+        self.executor.shutdown(wait=False)
+        self.engine.transport.close()
+        if self.engine.store is not None:
+            self.engine.store.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="以 HTTP / WebSocket 服务的方式运行情绪流水线")
+    parser.add_argument("--config", default="config.json", help="配置文件路径")
+    parser.add_argument("--host", help="监听地址，默认使用配置中的 server_host")
+    parser.add_argument("--port", type=int, help="监听端口，默认使用配置中的 server_port")
+    args = parser.parse_args()
+
+    config = Config.load_from_file(args.config)
+    server = PipelineServer(config)
+    print(f"服务已启动: http://{args.host or config.server_host}:{args.port or config.server_port}")
+    try:
+        asyncio.run(server.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
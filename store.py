@@ -0,0 +1,139 @@
+import json
+import sqlite3
+import threading
+import time
+
+from protocol import AnalysisResult
+
+
+class StoredTurn:
+    """对话记录中的一条消息"""
+
+    __slots__ = ("id", "conversation_id", "created", "role", "speaker", "content", "analysis")
+
+    def __init__(self, id, conversation_id, created, role, speaker, content, analysis=None):
+        self.id = id
+        self.conversation_id = conversation_id
+        self.created = created
+        self.role = role          # "user" / "assistant"
+        self.speaker = speaker    # 写入时的用户名或机器人名字
+        self.content = content
+        self.analysis = analysis  # 机器人回复对应的 AnalysisResult，用户消息为 None
+
+    def display_line(self):
+        """聊天框中显示的文本，修复重复名称问题"""
+        if self.role == "assistant" and self.content.startswith(f"{self.speaker}:"):
+            return self.content
+        return f"{self.speaker}: {self.content}"
+
+
+class ConversationStore:
+    """只追加写入的对话记录，保存在 SQLite 中，按 (对话, id) 建索引以便分页读取"""
+
+    def __init__(self, path="heartchat.db"):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS turns ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+            "conversation_id TEXT NOT NULL, "
+            "created REAL NOT NULL, "
+            "role TEXT NOT NULL, "
+            "speaker TEXT NOT NULL, "
+            "content TEXT NOT NULL, "
+            "temperature REAL, "
+            "top_p REAL, "
+            "emotions TEXT, "
+            "prompt TEXT, "
+            "source TEXT)"
+        )
+        # 旧版本创建的表没有 source 列，补上；之前写入的记录 source 为 NULL
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(turns)")}
+        if "source" not in columns:
+            self._conn.execute("ALTER TABLE turns ADD COLUMN source TEXT")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS turns_conversation ON turns (conversation_id, id)")
+        self._conn.commit()
+
+    def append(self, conversation_id, role, speaker, content, analysis=None, source=None):
+        """追加一条消息，返回它的 id
+
+        source 是分析结果的来源："remote"（Robot1）/ "prescorer"（本地评分）/ "fused"（合并模式）。
+        """
+        if analysis is not None:
+            values = (analysis.temperature, analysis.top_p, json.dumps(analysis.emotions()), analysis.prompt)
+        else:
+            values = (None, None, None, None)
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO turns (conversation_id, created, role, speaker, content, temperature, top_p, emotions, prompt, "
+                "source) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (conversation_id, time.time(), role, speaker, content) + values + (source,)
+            )
+            self._conn.commit()
+            return cursor.lastrowid
+
+    def _row_to_turn(self, row):
+        turn_id, conversation_id, created, role, speaker, content, temperature, top_p, emotions, prompt = row
+        analysis = None
+        if emotions is not None:
+            analysis = AnalysisResult(temperature, top_p, json.loads(emotions), prompt or "")
+        return StoredTurn(turn_id, conversation_id, created, role, speaker, content, analysis)
+
+    def load_before(self, conversation_id, before_id=None, limit=50):
+        """读取 before_id 之前（不含）最近的 limit 条消息，按时间正序返回；before_id 为 None 时读取最新的"""
+        if before_id is None:
+            before_id = 1 << 62
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, conversation_id, created, role, speaker, content, temperature, top_p, emotions, prompt "
+                "FROM turns WHERE conversation_id = ? AND id < ? ORDER BY id DESC LIMIT ?",
+                (conversation_id, before_id, limit)
+            ).fetchall()
+        return [self._row_to_turn(row) for row in reversed(rows)]
+
+    def has_before(self, conversation_id, before_id):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT 1 FROM turns WHERE conversation_id = ? AND id < ? LIMIT 1",
+                (conversation_id, before_id)
+            ).fetchone()
+        return row is not None
+
+    def load_analyzed(self, limit=None, exclude_sources=()):
+        """读取带分析结果的机器人回复及其之前最近的一条用户消息，返回 [(用户消息, AnalysisResult)]
+
+        exclude_sources 中来源的记录会被跳过；没有记录来源的旧数据总是保留。
+        """
+        sql = (
+            "SELECT (SELECT u.content FROM turns u WHERE u.conversation_id = a.conversation_id "
+            "AND u.id < a.id AND u.role = 'user' ORDER BY u.id DESC LIMIT 1), "
+            "a.temperature, a.top_p, a.emotions, a.prompt "
+            "FROM turns a WHERE a.role = 'assistant' AND a.emotions IS NOT NULL"
+        )
+        params = tuple(exclude_sources)
+        if params:
+            sql += f" AND (a.source IS NULL OR a.source NOT IN ({', '.join('?' * len(params))}))"
+        sql += " ORDER BY a.id DESC"
+        if limit:
+            sql += " LIMIT ?"
+            params += (limit,)
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        return [
+            (user_message, AnalysisResult(temperature, top_p, json.loads(emotions), prompt or ""))
+            for user_message, temperature, top_p, emotions, prompt in reversed(rows)
+            if user_message is not None
+        ]
+
+    def latest_conversation(self):
+        """最近一次写入的对话 id，没有记录时返回 None"""
+        with self._lock:
+            row = self._conn.execute("SELECT conversation_id FROM turns ORDER BY id DESC LIMIT 1").fetchone()
+        return row[0] if row else None
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
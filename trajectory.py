@@ -0,0 +1,134 @@
+import time
+
+from protocol import EMOTION_NAMES
+
+try:
+    import numpy as np
+except ImportError:  # NumPy 是可选依赖
+    np = None
+
+DIMENSIONS = len(EMOTION_NAMES)
+
+
+def _round(vector):
+    return tuple(round(float(value), 3) for value in vector)
+
+
+class EmotionTimeline:
+    """一个对话的情绪轨迹
+
+    每轮的原始情绪向量、平滑后的情绪向量和时间保存在预分配的数组中，满了按两倍扩容，
+    追加是均摊 O(1)，整段对话的统计可以一次向量化算完。没有安装 NumPy 时退回列表实现。
+    """
+
+    def __init__(self, capacity=64):
+        self._size = 0
+        self._capacity = capacity
+        if np is not None:
+            self._raw = np.zeros((capacity, DIMENSIONS))
+            self._smoothed = np.zeros((capacity, DIMENSIONS))
+            self._times = np.zeros(capacity)
+        else:
+            self._raw = []
+            self._smoothed = []
+            self._times = []
+
+    def __len__(self):
+        return self._size
+
+    def _grow(self):
+        self._capacity *= 2
+        for name in ("_raw", "_smoothed", "_times"):
+            old = getattr(self, name)
+            new = np.zeros((self._capacity,) + old.shape[1:])
+            new[:self._size] = old[:self._size]
+            setattr(self, name, new)
+
+    def preview(self, vector, alpha, half_life=0.0, now=None):
+        """计算加入 vector 后平滑的情绪向量，但不写入轨迹
+
+        上一轮的平滑结果先按经过的时间向 0 衰减（half_life 为 0 时不衰减），
+        再和本轮的向量按 alpha : 1 - alpha 加权。
+        """
+        if self._size == 0:
+            return _round(vector)
+        previous = self._smoothed[self._size - 1]
+        factor = 1.0 - alpha
+        if half_life > 0:
+            elapsed = max(0.0, (now if now is not None else time.time()) - self._times[self._size - 1])
+            factor *= 0.5 ** (elapsed / half_life)
+        return _round(alpha * value + factor * last for value, last in zip(vector, previous))
+
+    def append(self, raw, smoothed, now=None):
+        now = now if now is not None else time.time()
+        if np is None:
+            self._raw.append(tuple(raw))
+            self._smoothed.append(tuple(smoothed))
+            self._times.append(now)
+        else:
+            if self._size == self._capacity:
+                self._grow()
+            self._raw[self._size] = raw
+            self._smoothed[self._size] = smoothed
+            self._times[self._size] = now
+        self._size += 1
+
+    def observe(self, vector, alpha, half_life=0.0, now=None):
+        """平滑并写入一轮，返回平滑后的向量"""
+        now = now if now is not None else time.time()
+        smoothed = self.preview(vector, alpha, half_life, now)
+        self.append(vector, smoothed, now)
+        return smoothed
+
+    def recent(self, count, smoothed=True):
+        """最近 count 轮的情绪向量（元组列表），用于绘制折线"""
+        rows = (self._smoothed if smoothed else self._raw)[max(0, self._size - count):self._size]
+        return [_round(row) for row in rows]
+
+    def stats(self):
+        """整段对话的统计：每种情绪原始值的均值、标准差、最小、最大值，相邻两轮的平均变化量，
+        以及平滑值按轮次的线性趋势（每轮的斜率）。没有记录时返回 None。"""
+        if self._size == 0:
+            return None
+        if np is None:
+            return self._stats_python()
+        raw = self._raw[:self._size]
+        smoothed = self._smoothed[:self._size]
+        mean = raw.mean(axis=0)
+        volatility = np.abs(np.diff(raw, axis=0)).mean(axis=0) if self._size > 1 else np.zeros(DIMENSIONS)
+        turns = np.arange(self._size) - (self._size - 1) / 2.0
+        denominator = float(turns @ turns)
+        trend = turns @ (smoothed - smoothed.mean(axis=0)) / denominator if denominator else np.zeros(DIMENSIONS)
+        return self._stats_dict(mean, raw.std(axis=0), raw.min(axis=0), raw.max(axis=0), volatility, trend)
+
+    def _stats_python(self):
+        n = self._size
+        columns = list(zip(*self._raw))
+        smoothed_columns = list(zip(*self._smoothed))
+        mean = [sum(column) / n for column in columns]
+        std = [(sum((value - m) ** 2 for value in column) / n) ** 0.5 for column, m in zip(columns, mean)]
+        volatility = [
+            sum(abs(b - a) for a, b in zip(column, column[1:])) / (n - 1) if n > 1 else 0.0
+            for column in columns
+        ]
+        turns = [index - (n - 1) / 2.0 for index in range(n)]
+        denominator = sum(t * t for t in turns)
+        trend = [
+            sum(t * (value - sum(column) / n) for t, value in zip(turns, column)) / denominator if denominator else 0.0
+            for column in smoothed_columns
+        ]
+        return self._stats_dict(mean, std, [min(c) for c in columns], [max(c) for c in columns], volatility, trend)
+
+    def _stats_dict(self, mean, std, low, high, volatility, trend):
+        named = lambda values: dict(zip(EMOTION_NAMES, _round(values)))
+        mean = named(mean)
+        return {
+            "turns": self._size,
+            "dominant": max(EMOTION_NAMES, key=mean.get),
+            "mean": mean,
+            "std": named(std),
+            "min": named(low),
+            "max": named(high),
+            "volatility": named(volatility),
+            "trend": named(trend),
+        }
@@ -0,0 +1,126 @@
+import json
+import threading
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import ConnectTimeoutError, NewConnectionError
+
+# 这些状态码通常是限流或服务端暂时不可用，值得退避后重试
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+# 单次退避等待的上限（秒），包括服务端通过 Retry-After 要求的等待时间
+RETRY_BACKOFF_MAX = 120.0
+
+
+class HttpTransport:
+    """共享的 HTTP 传输层：每个端点一个连接池会话，带超时和 keep-alive
+
+    传输层本身不重试，重试和切换端点都由 routing.Router 决定。
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def _endpoint_key(self, url):
+        """按 scheme + host 区分端点，同一主机的请求复用同一个连接池"""
+        parts = urlsplit(url)
+        return f"{parts.scheme}://{parts.netloc}"
+
+    def _build_session(self):
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=self.config.pool_size,
+            max_retries=0,
+        )
+        session = requests.Session()
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        session.headers["Connection"] = "keep-alive"
+        return session
+
+    def _session_for(self, url):
+        key = self._endpoint_key(url)
+        with self._lock:
+            session = self._sessions.get(key)
+            if session is None:
+                session = self._build_session()
+                self._sessions[key] = session
+            return session
+
+    def post(self, url, api_key, payload, stream=False):
+        """向 OpenAI 兼容接口发送一次 chat/completions 请求"""
+        session = self._session_for(url)
+        return session.post(
+            url,
+            headers={"Authorization": f"Bearer {api_key}"},
+            json=payload,
+            timeout=(self.config.connect_timeout, self.config.read_timeout),
+            stream=stream,
+        )
+
+    def close(self):
+        """关闭所有连接池，下次请求时按当前配置重新创建"""
+        with self._lock:
+            sessions = list(self._sessions.values())
+            self._sessions.clear()
+        for session in sessions:
+            session.close()
+
+
+def is_connect_error(error):
+    """请求还没有发到服务端就失败了（连接被拒绝、连接超时等），重试不会让同一个生成请求被重复计费"""
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    if isinstance(error, requests.exceptions.ConnectionError) and error.args:
+        return isinstance(getattr(error.args[0], "reason", None), (NewConnectionError, ConnectTimeoutError))
+    return False
+
+
+def retry_after(response):
+    """响应头 Retry-After 要求的等待秒数，没有或无法解析时返回 None"""
+    value = response.headers.get("Retry-After")
+    try:
+        return min(RETRY_BACKOFF_MAX, max(0.0, float(value))) if value else None
+    except ValueError:
+        return None
+
+
+def iter_sse_content(response, on_usage=None):
+    """解析 SSE 流式响应，依次产出 choices[0].delta.content 文本片段；带 usage 的片段会交给 on_usage"""
+    data_lines = []
+    # 按字节读取再用 UTF-8 解码，SSE 响应头常常不带 charset，交给 requests 猜会把中文解码错
+    for raw_line in response.iter_lines():
+        line = raw_line.decode("utf-8")
+        if line:
+            if line.startswith("data:"):
+                data_lines.append(line[5:].lstrip())
+            continue
+        # 空行表示一个事件结束
+        if not data_lines:
+            continue
+        data = "\n".join(data_lines)
+        data_lines = []
+        if data == "[DONE]":
+            return
+        content = _delta_content(data, on_usage)
+        if content:
+            yield content
+    if data_lines:
+        data = "\n".join(data_lines)
+        if data != "[DONE]":
+            content = _delta_content(data, on_usage)
+            if content:
+                yield content
+
+
+def _delta_content(data, on_usage=None):
+    try:
+        chunk = json.loads(data)
+    except json.JSONDecodeError:
+        return ""
+    if on_usage is not None and chunk.get("usage"):
+        on_usage(chunk["usage"])
+    choices = chunk.get("choices") or [{}]
+    return (choices[0].get("delta") or {}).get("content") or ""